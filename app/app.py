@@ -7,16 +7,19 @@ from datetime import date, datetime, timedelta
 import flask
 from flask import Flask, request, make_response, session
 import dash
-from dash import CeleryManager, html, dcc
+from dash import html, dcc
 import dash_bootstrap_components as dbc
 from dotenv import load_dotenv, find_dotenv
-import redis
 from flask.helpers import get_root_path
 from celery import Celery, Task
 import pandas as pd
 import plotly.io as pio
 from conf import GlobalUInterface, DISPLAY_NAME, BASE_PATH as APP_SLUG
 from auth import is_app_authenticated
+from redis_pool import get_redis_client, celery_redis_settings, pool_stats
+from dash_app.prompt_cache import cache_stats
+from dash_app.image_store import register_image_route
+from task_queues import celery_queue_settings, create_callback_managers
 load_dotenv(find_dotenv())
 
 """
@@ -38,7 +41,7 @@ Slack (Optional):
 Running the app:
 	Open two terminals and run the following:
 	flask --app app run -p 1701    # Run the app on port 1701
-	celery -A app:celery_app worker --loglevel=INFO --concurrency=2 -Q {queue id}    # Run the celery worker, replace {queue id} with value like 'prefix-queue' where 'prefix' is your app prefix
+	celery -A app:celery_app worker --loglevel=INFO --concurrency=2 -Q {prefix}.text,{prefix}.image,{prefix}.data,{prefix}.maintenance    # Run the celery worker, replace {prefix} with your SERVER_NAME; see task_queues.py for running a pool per queue
 """
 
 # Configure logging
@@ -57,7 +60,7 @@ BASE_PATH = f'/{APP_SLUG}'
 FLASK_SECRET_KEY = os.environ['FLASK_SECRET_KEY'] 
 # Boolean flag from env; accepts 1/true/yes/on
 ENABLE_GOOGLE_AUTH = os.getenv('ENABLE_GOOGLE_AUTH', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
-redis_client = redis.from_url(REDIS_URL)
+redis_client = get_redis_client(REDIS_URL)
 cache_uuid = uuid.uuid4().hex
 ui = GlobalUInterface()
 
@@ -112,20 +115,16 @@ def create_celery_server(server):
 		include=['dash_app.callbacks'],
 	)
 
-	# Set a unique queue name per app to avoid issues when multiple apps share the same Redis server
-	queue_name = SERVER_NAME
-	celery_app.conf.task_default_queue = queue_name
-	celery_app.conf.task_routes = {
-		'app.*': {'queue': queue_name},
-		'long_callback_*': {'queue': queue_name},
-	}
-
+	# Queues are prefixed per app to avoid issues when multiple apps share the same Redis server
+	redis_settings = celery_redis_settings()
 	celery_app.conf.update(
 		event_serializer='json',
 		task_serializer='json',
 		result_serializer='json',
 		accept_content=['json'],
+		**redis_settings,
 		)
+	celery_app.conf.update(**celery_queue_settings(SERVER_NAME, redis_settings['broker_transport_options']))
 	celery_app.set_default()
 	server.extensions["celery"] = celery_app
 	return celery_app
@@ -196,6 +195,19 @@ def create_flask_server():
 			except Exception:
 				return 'degraded', 503
 
+		@server.route('/healthz/redis')
+		def healthz_redis():
+			# Per-process pool saturation; see redis_pool.pool_stats
+			return flask.jsonify(pool_stats())
+
+		@server.route('/healthz/prompt-cache')
+		def healthz_prompt_cache():
+			# Hit ratio per AI prompt cache; see dash_app.prompt_cache
+			return flask.jsonify(cache_stats())
+
+		# Content-addressed AI images; see dash_app.image_store
+		register_image_route(server)
+
 	if ENABLE_GOOGLE_AUTH:
 		logger.info('* Google Auth enabled * ')
 		from auth import setup_oauth
@@ -216,7 +228,9 @@ server = create_flask_server()
 logger.info('Flask server successfuly initialized')
 celery_app = create_celery_server(server)
 logger.info('Celery succesfully initialized')
-BACKGROUND_CALLBACK_MANAGER = CeleryManager(celery_app)
+# One manager per task class; each routes its background callbacks to that class's queue
+BACKGROUND_CALLBACK_MANAGERS = create_callback_managers(celery_app, SERVER_NAME)
+BACKGROUND_CALLBACK_MANAGER = BACKGROUND_CALLBACK_MANAGERS['text']
 logger.info('Celery/Dash integration complete')
 server = create_dash_app(server)
 logger.info('Dash app successfuly initialized')
\ No newline at end of file
@@ -4,14 +4,15 @@ import re
 import logging
 import json
 import uuid
+import time
+import hashlib
+import threading
 import requests
-import redis
 from datetime import timedelta
 
 import google.auth
 import flask
 from cryptography.fernet import Fernet
-from google.cloud import secretmanager
 from flask_dance.contrib.google import make_google_blueprint, google
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
@@ -20,13 +21,15 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from dash import html, get_asset_url
 import dash_bootstrap_components as dbc
 from urllib.parse import urlparse
+from dash_app.utils import TTLCache, get_secret
+from redis_pool import get_redis_client
 
 logger = logging.getLogger(__name__)
 
 # ---------- Env & globals ----------
 CACHE_KEY = os.environ.get('SERVER_NAME').lower()
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-redis_client = redis.from_url(REDIS_URL)
+redis_client = get_redis_client(REDIS_URL)
 
 FLASK_ENCRYPTION_KEY = os.environ['FLASK_ENCRYPTION_KEY']  # required
 ENABLE_GOOGLE_AUTH = os.getenv('ENABLE_GOOGLE_AUTH', 'true').lower() == 'true'
@@ -41,6 +44,24 @@ try:
 except Exception:
 	AUTHORIZED_DOMAINS = []
 
+# In-process cache of is_app_authenticated decisions per session_id (positive and negative).
+# Entries are dropped across all processes via Redis pub/sub on login and revoke; the TTL bounds
+# staleness if a message is missed.
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', '30'))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '10000'))
+AUTH_INVALIDATION_CHANNEL = f'{CACHE_KEY}:auth:invalidate'
+_auth_decisions = TTLCache(ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_MAX_ENTRIES)
+# Google userinfo per (session_id, access token), so page checks don't call Google on every
+# request. Entries never outlive the access token.
+USERINFO_CACHE_TTL = int(os.getenv('USERINFO_CACHE_TTL', '300'))
+_userinfo_cache = TTLCache(ttl=USERINFO_CACHE_TTL, max_entries=AUTH_CACHE_MAX_ENTRIES)
+# Digest of the last credentials payload written to Redis per session, to skip redundant writes
+_saved_credentials = TTLCache(ttl=USERINFO_CACHE_TTL, max_entries=AUTH_CACHE_MAX_ENTRIES)
+# Seconds before a failed invalidation listener is restarted; the TTL covers the gap
+AUTH_LISTENER_RETRY = float(os.getenv('AUTH_LISTENER_RETRY', '5'))
+_auth_listener = {'pid': None, 'thread': None, 'retry_at': 0.0}
+_auth_listener_lock = threading.Lock()
+
 GOOGLE_SCOPES = [
 	'https://www.googleapis.com/auth/userinfo.email',
 	'https://www.googleapis.com/auth/userinfo.profile',
@@ -48,22 +69,9 @@ GOOGLE_SCOPES = [
 ]
 
 # ---------- Secret Manager helpers (OAuth client JSON) ----------
-def _read_secret_json(secret_name: str, version: str = 'latest', project_id: str | None = None) -> dict:
-	project_id = project_id or os.getenv('GCP_PROJECT') or os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('PROJECT_ID')
-	
-	# If env vars are missing, try to auto-detect from GCloud environment
-	if not project_id:
-		try:
-			_, project_id = google.auth.default()
-		except Exception:
-			pass
-
-	if not project_id:
-		raise RuntimeError('GCP project id not set (GCP_PROJECT, GOOGLE_CLOUD_PROJECT, or PROJECT_ID). Are you signed in to gcloud cli?')
-	client = secretmanager.SecretManagerServiceClient()
-	name = f'projects/{project_id}/secrets/{secret_name}/versions/{version}'
-	resp = client.access_secret_version(request={'name': name})
-	return json.loads(resp.payload.data.decode('utf-8'))
+def _read_secret_json(secret_name: str, version: str = 'latest') -> dict:
+	# Shares the process-level secret cache and Secret Manager client with dash_app.utils.load_secret
+	return json.loads(get_secret(secret_name, version))
 
 def _select_redirect_uri(uris: list[str], base_path: str) -> str | None:
     """
@@ -151,6 +159,63 @@ class AuthCredentials:
 			return json.loads(self.decrypt_data(encrypted_credentials.decode()))
 		return None
 
+# One store (and Fernet instance) per process
+CREDS_STORE = AuthCredentials(CACHE_KEY, FLASK_ENCRYPTION_KEY)
+
+def _on_auth_invalidation(message: dict) -> None:
+	session_id = message.get('data')
+	if isinstance(session_id, bytes):
+		session_id = session_id.decode()
+	if session_id == '*':
+		_auth_decisions.clear()
+	else:
+		_auth_decisions.delete(session_id)
+
+def _on_auth_listener_error(error: Exception, pubsub, thread) -> None:
+	"""Stops a failed listener thread so the next request starts a fresh one after AUTH_LISTENER_RETRY."""
+	logger.warning(f'Auth invalidation listener failed, restarting in {AUTH_LISTENER_RETRY}s: {error}')
+	thread.stop()
+	try:
+		pubsub.close()
+	except Exception:
+		pass
+	with _auth_listener_lock:
+		if _auth_listener['thread'] is thread:
+			_auth_listener['pid'] = None
+			_auth_listener['thread'] = None
+			_auth_listener['retry_at'] = time.monotonic() + AUTH_LISTENER_RETRY
+
+def _ensure_auth_listener() -> None:
+	"""
+	Starts the pub/sub invalidation listener once per process (again in each forked child), and
+	again after it fails.
+	"""
+	pid = os.getpid()
+	if _auth_listener['pid'] == pid or time.monotonic() < _auth_listener['retry_at']:
+		return
+	with _auth_listener_lock:
+		if _auth_listener['pid'] == pid or time.monotonic() < _auth_listener['retry_at']:
+			return
+		# Anything cached before a fork or while no listener ran may have missed invalidations
+		_auth_decisions.clear()
+		try:
+			pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+			pubsub.subscribe(**{AUTH_INVALIDATION_CHANNEL: _on_auth_invalidation})
+			_auth_listener['thread'] = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=_on_auth_listener_error)
+		except Exception as e:
+			logger.warning(f'Auth invalidation listener unavailable, relying on TTL and retrying in {AUTH_LISTENER_RETRY}s: {e}')
+			_auth_listener['retry_at'] = time.monotonic() + AUTH_LISTENER_RETRY
+			return
+		_auth_listener['pid'] = pid
+
+def invalidate_auth_cache(session_id: str) -> None:
+	"""Drops the cached auth decision for a session in this and every other process."""
+	_auth_decisions.delete(session_id)
+	try:
+		redis_client.publish(AUTH_INVALIDATION_CHANNEL, session_id)
+	except Exception as e:
+		logger.warning(f'Could not publish auth invalidation: {e}')
+
 def check_authorization() -> bool:
 	"""
 	If Google OAuth is authorized, fetch user info, enforce domain allowlist,
@@ -163,13 +228,28 @@ def check_authorization() -> bool:
 	if not google.authorized:
 		return False
 
-	creds_store = AuthCredentials(CACHE_KEY, FLASK_ENCRYPTION_KEY)
+	creds_store = CREDS_STORE
 
 	try:
-		resp = google.get('/oauth2/v1/userinfo')
-		if not resp or not resp.ok:
-			return False
-		user_info = (resp.json() or {})
+		# Ensure we have a session_id
+		session_id = flask.session.get('session_id')
+		if not session_id:
+			session_id = str(uuid.uuid4())
+			flask.session['session_id'] = session_id
+
+		token = flask.session.get('google_oauth_token') or {}
+		userinfo_key = (session_id, token.get('access_token'))
+		user_info = _userinfo_cache.get(userinfo_key)
+		if user_info is TTLCache.MISS:
+			resp = google.get('/oauth2/v1/userinfo')
+			if not resp or not resp.ok:
+				return False
+			user_info = (resp.json() or {})
+			ttl = USERINFO_CACHE_TTL
+			if token.get('expires_at'):
+				ttl = min(ttl, token['expires_at'] - time.time())
+			if ttl > 0:
+				_userinfo_cache.set(userinfo_key, user_info, ttl=ttl)
 		user_email = (user_info.get('email') or '').lower()
 		user_domain = user_email.split('@')[-1] if '@' in user_email else ''
 
@@ -177,17 +257,16 @@ def check_authorization() -> bool:
 		if AUTHORIZED_DOMAINS and user_domain not in AUTHORIZED_DOMAINS:
 			flask.abort(403, description='Access denied: Unauthorized email domain')
 
-		# Ensure we have a session_id
-		session_id = flask.session.get('session_id')
-		if not session_id:
-			session_id = str(uuid.uuid4())
-			flask.session['session_id'] = session_id
-
-		# Persist (encrypted) in Redis
-		creds_store.save_google_credentials(session_id, {
+		# Persist (encrypted) in Redis, only when the payload changed
+		payload = {
 			'user_info': user_info,
 			'google_oauth_token': flask.session.get('google_oauth_token'),
-		})
+		}
+		digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+		if _saved_credentials.get(session_id) != digest:
+			creds_store.save_google_credentials(session_id, payload)
+			invalidate_auth_cache(session_id)
+			_saved_credentials.set(session_id, digest)
 
 		# Also cache a light user obj in the Flask session for quick checks
 		flask.session['user'] = {
@@ -296,7 +375,7 @@ def setup_oauth(server: flask.Flask, *, base_path: str) -> flask.Flask:
 			flask.session.clear()
 
 		# Retrieve credentials from Redis
-		creds_store = AuthCredentials(CACHE_KEY, FLASK_ENCRYPTION_KEY)
+		creds_store = CREDS_STORE
 		cred_data = creds_store.get_google_credentials(session_id)
 		if not cred_data:
 			logger.debug('No credentials found in Redis for session.')
@@ -355,6 +434,8 @@ def setup_oauth(server: flask.Flask, *, base_path: str) -> flask.Flask:
 
 			# Clear Redis and Flask session
 			redis_client.delete(f'{CACHE_KEY}:session:{session_id}')
+			invalidate_auth_cache(session_id)
+			_saved_credentials.delete(session_id)
 			flask.session.clear()
 
 			if revoke_response.status_code == 200:
@@ -383,12 +464,19 @@ def is_app_authenticated() -> bool:
 	sid = flask.session.get('session_id')
 	if not sid:
 		return False
+	_ensure_auth_listener()
+	cached = _auth_decisions.get(sid)
+	if cached is not TTLCache.MISS:
+		if cached:
+			flask.session['google_oauth_token'] = cached['google_oauth_token']
+		return bool(cached)
 	try:
-		from auth import AuthCredentials
-		creds = AuthCredentials(CACHE_KEY, FLASK_ENCRYPTION_KEY).get_google_credentials(sid)
+		creds = CREDS_STORE.get_google_credentials(sid)
 		if creds and 'google_oauth_token' in creds:
 			flask.session['google_oauth_token'] = creds['google_oauth_token']
+			_auth_decisions.set(sid, {'google_oauth_token': creds['google_oauth_token']})
 			return True
+		_auth_decisions.set(sid, False)
 	except Exception as e:
 		flask.current_app.logger.debug(f'Auth lookup failed: {e}')
 	return False
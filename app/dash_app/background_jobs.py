@@ -0,0 +1,186 @@
+import os
+import logging
+import functools
+import flask
+import redis
+from dash.exceptions import PreventUpdate
+from redis_pool import get_redis_client
+
+"""
+Session-scoped tracking, coalescing and cancellation of background callback jobs
+
+Identical requests are coalesced at dispatch: a callback whose Dash cache key (its arguments minus
+`cache_args_to_ignore`, e.g. the session id) matches a job already in flight is handed that job
+instead of a new one, so duplicates never reach a worker and read the same result. That result
+stays readable for BACKGROUND_RESULT_TTL after the job ends, and identical requests arriving in that
+window are answered from it too, rather than replacing it under sessions that haven't read it yet.
+
+Jobs are shared by the sessions subscribed to them: the one that dispatched it and any coalesced
+onto it. Each background callback keeps at most one job per session; when a session submits again
+(from another tab, after a reload, ...) or the client cancels (a `cancel` input fired, e.g. page
+navigation), the session unsubscribes from its previous job. Once no session is left waiting, the
+job is cancelled (task_queues.cancel_job):
+	- flagged in Redis; a job checks the flag when it starts and on every set_progress() call
+	- revoked with terminate, so a worker drops it if queued or kills it mid-request
+	- released right away, so the session's rate-limit slot and the pool's worker are free for
+	  whatever it submits next
+Killed jobs skip their `finally` blocks, so nothing a job holds may depend on them: slots and pool
+capacity are tied to the job id instead and released via finish_job(), exactly once, whether the
+job completes, is revoked or is cancelled.
+
+Settings (env):
+	BACKGROUND_JOB_TTL           seconds job ids and cancel flags are kept (default 900)
+	BACKGROUND_RESULT_TTL        seconds a job's result stays readable after it finishes or is read (default 30)
+"""
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_JOB_TTL = int(os.getenv('BACKGROUND_JOB_TTL', '900'))
+BACKGROUND_RESULT_TTL = int(os.getenv('BACKGROUND_RESULT_TTL', '30'))
+
+# Returns the job already producing KEYS[1]'s result, else records ARGV[1] as that job
+_COALESCE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+	return current
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+return ARGV[1]
+"""
+
+# Removes ARGV[1] from a job's subscribers. Returns 1 if it was the last one
+_UNSUBSCRIBE_SCRIPT = """
+if redis.call('SREM', KEYS[1], ARGV[1]) == 1 and redis.call('SCARD', KEYS[1]) == 0 then
+	return 1
+end
+return 0
+"""
+
+# Deletes and returns a job's metadata, clearing its in-flight marker if it still owns it
+_FINISH_SCRIPT = """
+local meta = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+for i = 1, #meta, 2 do
+	if meta[i] == 'cache_key' then
+		local inflight = 'background-job-inflight:' .. meta[i + 1]
+		if redis.call('GET', inflight) == ARGV[1] then
+			redis.call('DEL', inflight)
+		end
+	end
+end
+return meta
+"""
+
+class JobCancelled(Exception):
+	pass
+
+def _job_key(job_id: str) -> str:
+	return f'background-job:{job_id}'
+
+def _cancel_key(job_id: str) -> str:
+	return f'background-job-cancelled:{job_id}'
+
+def _decode(value):
+	return value.decode() if isinstance(value, bytes) else value
+
+def coalesce_job(cache_key: str, job_id: str) -> str:
+	"""Returns the in-flight job for `cache_key`, or `job_id` if there is none and the caller should dispatch it."""
+	try:
+		client = get_redis_client()
+		return _decode(client.register_script(_COALESCE_SCRIPT)(keys=[f'background-job-inflight:{cache_key}'], args=[job_id, BACKGROUND_JOB_TTL]))
+	except redis.RedisError as e:
+		logger.warning(f'Background job coalescing unavailable: {e}')
+		return job_id
+
+def register_job(job_id: str, **meta) -> None:
+	try:
+		get_redis_client().pipeline().hset(_job_key(job_id), mapping={k: v for k, v in meta.items() if v is not None}).expire(_job_key(job_id), BACKGROUND_JOB_TTL).execute()
+	except redis.RedisError as e:
+		logger.warning(f'Could not record background job {job_id}: {e}')
+
+def job_registered(job_id: str) -> bool:
+	try:
+		return bool(get_redis_client().exists(_job_key(job_id)))
+	except redis.RedisError:
+		return True
+
+def finish_job(job_id: str) -> dict:
+	"""Clears a finished or revoked job's metadata. Returns it the first time, {} after that."""
+	try:
+		client = get_redis_client()
+		meta = client.register_script(_FINISH_SCRIPT)(keys=[_job_key(job_id)], args=[job_id])
+	except redis.RedisError as e:
+		logger.warning(f'Could not finish background job {job_id}: {e}')
+		return {}
+	return {_decode(meta[i]): _decode(meta[i + 1]) for i in range(0, len(meta), 2)}
+
+def current_session_id() -> str | None:
+	return flask.session.get('session_id') if flask.has_request_context() else None
+
+def current_job_id() -> str | None:
+	from celery import current_task
+	return current_task.request.id if current_task else None
+
+def flag_cancelled(job_id: str) -> None:
+	try:
+		get_redis_client().set(_cancel_key(job_id), 1, ex=BACKGROUND_JOB_TTL)
+	except redis.RedisError as e:
+		logger.warning(f'Could not flag background job {job_id} as cancelled: {e}')
+
+def subscribe(job_id: str, session_id: str) -> None:
+	try:
+		get_redis_client().pipeline().sadd(f'{_job_key(job_id)}:sessions', session_id).expire(f'{_job_key(job_id)}:sessions', BACKGROUND_JOB_TTL).execute()
+	except redis.RedisError as e:
+		logger.warning(f'Could not subscribe to background job {job_id}: {e}')
+
+def unsubscribe(job_id: str, session_id: str) -> bool:
+	"""Drops the session's interest in job_id. True if no other session is waiting for it."""
+	try:
+		client = get_redis_client()
+		return bool(client.register_script(_UNSUBSCRIBE_SCRIPT)(keys=[f'{_job_key(job_id)}:sessions'], args=[session_id]))
+	except redis.RedisError as e:
+		logger.warning(f'Could not unsubscribe from background job {job_id}: {e}')
+		return False
+
+def track_job(callback: str, session_id: str, job_id: str) -> str | None:
+	"""Records `job_id` as the session's job for `callback`. Returns the job it replaces, if any."""
+	try:
+		previous = _decode(get_redis_client().set(f'background-job:{callback}:{session_id}', job_id, ex=BACKGROUND_JOB_TTL, get=True))
+	except redis.RedisError as e:
+		logger.warning(f'Background job tracking unavailable: {e}')
+		return None
+	return previous if previous and previous != job_id else None
+
+def job_cancelled(job_id: str | None) -> bool:
+	if not job_id:
+		return False
+	try:
+		return bool(get_redis_client().exists(_cancel_key(job_id)))
+	except redis.RedisError as e:
+		logger.warning(f'Could not check background job {job_id}: {e}')
+		return False
+
+def cancellable(fn, progress=False):
+	"""
+	Wraps a background callback so it stops once its job is cancelled: before it starts and, for
+	callbacks with `progress`, at each set_progress() call.
+	"""
+	@functools.wraps(fn)
+	def wrapper(*args, **kwargs):
+		job_id = current_job_id()
+		if job_cancelled(job_id):
+			logger.info(f'[{fn.__name__}] job {job_id} was cancelled before it started')
+			raise PreventUpdate
+		if progress and job_id:
+			set_progress = args[0]
+			def checked_progress(value):
+				if job_cancelled(job_id):
+					raise JobCancelled(job_id)
+				set_progress(value)
+			args = (checked_progress, *args[1:])
+		try:
+			return fn(*args, **kwargs)
+		except JobCancelled:
+			logger.info(f'[{fn.__name__}] job {job_id} cancelled')
+			raise PreventUpdate
+	return wrapper
@@ -20,7 +20,9 @@ import numpy as np
 from dash_app.pages.ai import UInterface as ai_ui
 from dash_app.pages.home import UInterface as home_ui
 from dash_app.pages.dashboard import UInterface as dashboard_ui
-from dash_app.pages.sales_enablement import UInterface as sales_ui
+from dash_app.pages.sales_enablement import UInterface as sales_ui, PITCH_PANEL_STYLE
+from dash_app.utils import prefetch_secrets
+from dash_app.rate_limit import rate_limited
 
 REDIS_URL = os.environ['REDIS_URL']
 
@@ -29,14 +31,27 @@ logger = logging.getLogger(__name__)
 AI_UI = None
 HOME_UI = None
 DASHBOARD_UI = None
+# dash.page_container's location; navigating away cancels a page's running background jobs
+PAGE_LOCATION_ID = '_pages_location'
+
+def rate_limit_alert(e):
+	# Built directly rather than via a page UI's show_alert so rejected requests return without loading page data
+	return dbc.Alert([
+		dbc.Stack([
+			html.I(className='bi bi-hourglass-split'),
+			html.Span(str(e)),
+		],direction='horizontal',gap=3),
+	],color='info',dismissable=True,className='alert-info')
 
 def register_callbacks(app):
-	from app import BACKGROUND_CALLBACK_MANAGER
+	from app import BACKGROUND_CALLBACK_MANAGERS
 
 	global AI_UI, DASHBOARD_UI, HOME_UI
 	if AI_UI is None: AI_UI = ai_ui()
 	if HOME_UI is None: HOME_UI = home_ui()
 	if DASHBOARD_UI is None:  DASHBOARD_UI  = dashboard_ui()
+	# Fetch AI credentials off the request path, in both the web and Celery worker processes
+	prefetch_secrets(['GEMINI_API_KEY'])
 
 #######################
 # Global
@@ -169,68 +184,72 @@ def register_callbacks(app):
 		Output('ai-image-container','children'),
 		Input('ai-input-image-submit', 'n_clicks'),
 		State('ai-input-image-text','value'),
+		State('session-id-store','data'),
 		running=[
 			(Output('ai-input-image-submit', 'disabled'), True, False),
 			(Output('ai-input-image-submit', 'children'), [dbc.Spinner(size='sm'),' Asking Gemini...'], [html.I(className='bi bi-robot'),' Submit']),
 		],
+		cancel=[Input(PAGE_LOCATION_ID, 'pathname')],
+		# Same prompt from any session or click shares one in-flight job (see QueuedCeleryManager)
+		cache_args_to_ignore=[0, 2],
 		prevent_initial_call=True,
 		background=True,
-    	manager=BACKGROUND_CALLBACK_MANAGER,
+    	manager=BACKGROUND_CALLBACK_MANAGERS['image'],
 	)
-	def ai_generate_image(n_clicks,input_prompt):
+	@rate_limited(on_limit=rate_limit_alert)
+	def ai_generate_image(n_clicks,input_prompt,session_id):
 		logger.info('[' + str(datetime.now()) + '] | '+ '[ai_generate_image] | ' + str(dash.ctx.triggered_id))
 		if dash.ctx.triggered_id == None:
 			raise PreventUpdate
 		else:
 			if n_clicks != None and n_clicks > 0:
-				image_url = None
+				image = {'full': None, 'display': None, 'srcset': None}
 				ui = ai_ui()
 				try:
-					image_url = ui.ai_generate_image(input_prompt, style='anime')
+					image = ui.ai_generate_image(input_prompt, style='anime')
 				except Exception as e:
 					logger.error(f'Error getting image url: {e}')
-				return html.Img(src=image_url,style={'width':'100%','border-radius':'4rem','padding':'2rem'})
+				# Display-sized variants inline; clicking opens the full-resolution original
+				return html.A(
+					html.Img(src=image['display'],srcSet=image['srcset'],sizes='(max-width: 768px) 100vw, 800px',style={'width':'100%','border-radius':'4rem','padding':'2rem'}),
+					href=image['full'],target='_blank',title='Open full resolution',
+				)
 
 
 	@app.callback(
-		Output('ai-chart-container','children'),
+		Output('ai-colors-chart-object','figure'),
+		Output('ai-colors-alert','children'),
 		Input('ai-input-colors-submit', 'n_clicks'),
 		State('ai-input-colors-text','value'),
+		State('session-id-store','data'),
 		running=[
 			(Output('ai-colors-chart-object','style'), {'display':'none'}, None),
 			(Output('loading-card', 'style'), None, {'display':'none'}),
 			(Output('ai-input-colors-submit', 'disabled'), True, False),
 			(Output('ai-input-colors-submit', 'children'), [dbc.Spinner(size='sm'),' Asking Gemini...'], [html.I(className='bi bi-robot'),' Submit']),
 		],
+		cancel=[Input(PAGE_LOCATION_ID, 'pathname')],
+		# Same prompt from any session or click shares one in-flight job (see QueuedCeleryManager)
+		cache_args_to_ignore=[0, 2],
 		prevent_initial_call=True,
 		background=True,
-    	manager=BACKGROUND_CALLBACK_MANAGER,
+    	manager=BACKGROUND_CALLBACK_MANAGERS['text'],
 	)
-	def ai_custom_colors(n_clicks,input_prompt):
+	@rate_limited(on_limit=lambda e: (dash.no_update, rate_limit_alert(e)))
+	def ai_custom_colors(n_clicks,input_prompt,session_id):
 		logger.info('[' + str(datetime.now()) + '] | '+ '[ai_custom_colors] | ' + str(dash.ctx.triggered_id))
 		if dash.ctx.triggered_id == None:
 			raise PreventUpdate
 		else:
 			if n_clicks != None and n_clicks > 0:
-				o = None
-				colors = []
 				ui = ai_ui()
-				try:
-					colors = ui.ai_color_sequence(input_prompt)
-					o = dashboard_ui().render_summary_charts(w=750,h=400,chart_only=True,colors=colors)
-				except Exception as e:
-					logger.warning('Retrying ...')
-					logger.warning(e)
-					try:
-						colors = ui.ai_color_sequence(input_prompt)
-						o = dashboard_ui().render_summary_charts(w=750,h=400,chart_only=True,colors=colors)
-					except Exception as e:
-						logger.error('Retry failed, falling back to default colors')
-						o = dbc.Stack([
-							ui.show_alert("We didn't get a usable response from Gemini. Sometimes you get a miss!  Try your prompt again, or try modifying it slightly.",color='warning'),
-							dashboard_ui().render_summary_charts(w=750,h=400,chart_only=True),
-						],gap=3)
-				return o
+				# Retries happen inside ai_color_sequence around the model call only
+				colors = ui.ai_color_sequence(input_prompt)
+				# Recolor the chart already on the page instead of rebuilding it from the data
+				if colors:
+					return dashboard_ui.recolor_summary_chart(colors), None
+				logger.error('No usable palette, falling back to default colors')
+				return dashboard_ui.recolor_summary_chart(), ui.show_alert("We didn't get a usable response from Gemini. Sometimes you get a miss!  Try your prompt again, or try modifying it slightly.",color='warning')
 		 
 	@app.callback(
 		Output('sales-pitch-output', 'children'),
@@ -241,17 +260,30 @@ def register_callbacks(app):
 		State('sales-input-audience', 'value'),
 		State('sales-input-style', 'value'),
 		State('sales-input-length', 'value'),
+		State('session-id-store', 'data'),
+		running=[
+			(Output('sales-pitch-submit', 'disabled'), True, False),
+			(Output('sales-pitch-submit', 'children'), [dbc.Spinner(size='sm'),' Generating...'], [html.I(className='bi bi-easel'),' Generate Deck']),
+			# Progress goes to its own panel so it never competes with the final output for a prop
+			(Output('sales-pitch-progress', 'style'), PITCH_PANEL_STYLE, {**PITCH_PANEL_STYLE, 'display': 'none'}),
+			(Output('sales-pitch-output', 'style'), {**PITCH_PANEL_STYLE, 'display': 'none'}, PITCH_PANEL_STYLE),
+		],
+		cancel=[Input(PAGE_LOCATION_ID, 'pathname')],
+		progress=[Output('sales-pitch-progress', 'children')],
+		progress_default=[None],
 		prevent_initial_call=True,
 		background=True,
-		manager=BACKGROUND_CALLBACK_MANAGER,
+		manager=BACKGROUND_CALLBACK_MANAGERS['image'],
 	)
-	def sales_generate_deck(n_clicks, company, industry, audience, style, length):
+	@rate_limited(on_limit=lambda e: (rate_limit_alert(e), None))
+	def sales_generate_deck(set_progress, n_clicks, company, industry, audience, style, length, session_id):
 		logger.info(f'[{datetime.now()}] | [sales_generate_deck] | trig_id: [{dash.ctx.triggered_id}]')
 		if not n_clicks:
 			raise PreventUpdate
 		
 		ui = sales_ui()
-		result = ui.ai_generate_deck(company, industry, audience, style, length)
+		set_progress([ui.deck_status()])
+		result = ui.ai_generate_deck(company, industry, audience, style, length, on_progress=lambda component: set_progress([component]))
 		
 		if 'error' in result:
 			return dcc.Markdown(result['error']), None
@@ -261,6 +293,22 @@ def register_callbacks(app):
 			
 		return dcc.Markdown("Error: No content generated."), None
 
+	@app.callback(
+		Output('sales-slide-modal', 'is_open'),
+		Output('sales-slide-modal-img', 'src'),
+		Input('sales-deck-expand', 'n_clicks'),
+		State('sales-deck-carousel', 'active_index'),
+		State('sales-deck-images', 'data'),
+		prevent_initial_call=True,
+	)
+	def sales_expand_slide(n_clicks, active_index, full_images):
+		if not n_clicks or not full_images:
+			raise PreventUpdate
+		src = full_images[min(active_index or 0, len(full_images) - 1)]
+		if not src:
+			raise PreventUpdate
+		return True, src
+
 	@app.callback(
 		Output("sales-onboarding-modal", "is_open"),
 		Input("close-onboarding-modal", "n_clicks"),
@@ -1,41 +1,171 @@
 import os
+import json
 import uuid
-import s3fs
-import gcsfs
+import base64
+import hashlib
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import re
 import pyarrow as pa
 import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyarrow.fs as pafs
 import logging
+import numpy as np
 import pandas as pd
 from typing import List, Any, Literal
-from datetime import date, datetime
+from datetime import date, datetime, timezone
+from urllib.parse import unquote
 from dotenv import load_dotenv
+import fsspec
+import redis
+from redis_pool import get_redis_client
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import s3fs
+except ImportError:
+    s3fs = None
+try:
+    import gcsfs
+except ImportError:
+    gcsfs = None
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-class CloudStorage:
+# Process-wide filesystem clients, keyed by (protocol, endpoint, credential digest).
+# Each client owns its own HTTP connection pool and resolved credentials, so sharing
+# them across CloudStorage instances and threads avoids repeated TLS handshakes and auth lookups.
+_FS_REGISTRY: dict[tuple, Any] = {}
+_FS_REGISTRY_LOCK = threading.Lock()
+_FS_REGISTRY_PID = os.getpid()
+# Upper bound on concurrent object-store requests issued by the batch APIs
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "8"))
+
+# Return types for the load_* methods:
+#   'pandas'               numpy-backed DataFrame (default, strings become Python objects)
+#   'arrow'                the pa.Table itself, no conversion; hand straight to DuckDB or compute kernels
+#   'pandas_arrow'         DataFrame backed by pd.ArrowDtype columns, avoids per-value string objects
+#   'pandas_self_destruct' numpy-backed DataFrame built with split_blocks/self_destruct, releasing
+#                          Arrow buffers column by column to roughly halve peak memory
+OutputFormat = Literal['pandas', 'arrow', 'pandas_arrow', 'pandas_self_destruct']
+
+# Per-dataset layout manifest, written next to the data. The leading underscore keeps it out of
+# pyarrow dataset discovery.
+MANIFEST_NAME = '_manifest.json'
+# File names store_dataset_parquet writes (its basename_template)
+_DATASET_FILE_NAME = re.compile(r'part-\d+-[0-9a-f]{32}\.parquet')
+
+# Parquet layout defaults for store_dataset_parquet. Smaller row groups give min/max statistics
+# and page indexes finer granularity for skipping; pyarrow's own default is ~1M rows per group.
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "131072"))
+# pyarrow's own max_rows_per_group for write_dataset
+PYARROW_MAX_ROWS_PER_GROUP = 1024 * 1024
+# Manifest updates are read-modify-write, so writers in every process (web, workers, ETL) take a
+# lock per dataset: a lock file for the 'file' backend, a Redis lock for object stores. The Redis
+# lock is held at most MANIFEST_LOCK_TIMEOUT seconds (so a crashed writer can't block the dataset
+# forever); either is waited on at most MANIFEST_LOCK_WAIT seconds.
+MANIFEST_LOCK_NAME = '_manifest.lock'
+MANIFEST_LOCK_TIMEOUT = float(os.getenv("MANIFEST_LOCK_TIMEOUT", "120"))
+MANIFEST_LOCK_WAIT = float(os.getenv("MANIFEST_LOCK_WAIT", "60"))
+_MANIFEST_LOCKS: dict[str, threading.Lock] = {}
+_MANIFEST_LOCKS_GUARD = threading.Lock()
+_manifest_lock_warned = False
+
+def _credential_digest(*parts: str | None) -> str:
+    return hashlib.sha256('\x00'.join(p or '' for p in parts).encode()).hexdigest()
+
+def reset_filesystem_registry() -> None:
     """
-    S3-compatible and GCS-compatible storage client for storing and loading data.
+    Drops every cached filesystem client. Runs automatically in the child after a fork
+    (gunicorn / celery prefork), since sockets and event loops must not be shared across processes.
     """
-    def __init__(self, protocol: str = None, endpoint: str = None):
-        self.protocol = (protocol or 's3').lower()
-        self.endpoint = endpoint or 'http://localhost:9000'
-        self.bucket = os.getenv("ETL_BUCKET", "etl-bucket")
-        
-        if self.protocol == 's3':
-            self.fs = s3fs.S3FileSystem(
-                client_kwargs={'endpoint_url': self.endpoint},
-                key=os.getenv("STORAGE_USER", "admin"),
-                secret=os.getenv("STORAGE_PASSWORD", ""), 
+    global _FS_REGISTRY_LOCK, _FS_REGISTRY_PID
+    _FS_REGISTRY.clear()
+    _FS_REGISTRY_LOCK = threading.Lock()
+    _FS_REGISTRY_PID = os.getpid()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_filesystem_registry)
+
+def get_filesystem(protocol: str, endpoint: str | None = None) -> Any:
+    """
+    Returns a shared fsspec filesystem for the protocol/endpoint/credentials combination,
+    creating it on first use.
+    """
+    protocol = protocol.lower()
+    if _FS_REGISTRY_PID != os.getpid():
+        reset_filesystem_registry()
+
+    if protocol == 's3':
+        user = os.getenv("STORAGE_USER", "admin")
+        password = os.getenv("STORAGE_PASSWORD", "")
+        registry_key = ('s3', endpoint, _credential_digest(user, password))
+    elif protocol in ('gcs', 'gs'):
+        project_id = os.getenv("GCS_PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT")
+        registry_key = ('gcs', project_id, _credential_digest(os.getenv("GOOGLE_APPLICATION_CREDENTIALS")))
+    elif protocol in ('file', 'memory'):
+        registry_key = (protocol, None, '')
+    else:
+        raise ValueError(f"Unsupported protocol: {protocol!r}")
+
+    fs = _FS_REGISTRY.get(registry_key)
+    if fs is not None:
+        return fs
+
+    with _FS_REGISTRY_LOCK:
+        fs = _FS_REGISTRY.get(registry_key)
+        if fs is not None:
+            return fs
+        if protocol == 's3':
+            if s3fs is None:
+                raise ImportError("s3fs is required for protocol 's3'")
+            fs = s3fs.S3FileSystem(
+                client_kwargs={'endpoint_url': endpoint},
+                key=user,
+                secret=password,
             )
-        elif self.protocol in ('gcs', 'gs'):
+        elif protocol in ('gcs', 'gs'):
+            if gcsfs is None:
+                raise ImportError("gcsfs is required for protocol 'gcs'")
             # GCSFS will use Google Application Default Credentials (ADC) automatically
             # Ensure GOOGLE_APPLICATION_CREDENTIALS env var is set or gcloud auth is configured
-            project_id = os.getenv("GCS_PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT")
-            self.fs = gcsfs.GCSFileSystem(project=project_id)
+            fs = gcsfs.GCSFileSystem(project=project_id)
+        elif protocol == 'file':
+            # Object stores have no directories; auto_mkdir gives local writes the same semantics
+            fs = fsspec.filesystem('file', auto_mkdir=True)
+        else:
+            fs = fsspec.filesystem('memory')
+        _FS_REGISTRY[registry_key] = fs
+        logger.info(f'Created {protocol} filesystem client (pid {os.getpid()})')
+        return fs
+
+class CloudStorage:
+    """
+    S3-compatible and GCS-compatible storage client for storing and loading data.
+    The 'file' and 'memory' protocols provide offline backends with the same semantics, for
+    local development, benchmarks and tests. For 'file', `endpoint` is the local root
+    directory (STORAGE_ROOT, default ./.storage) that holds the bucket.
+    `bucket` defaults to ETL_BUCKET.
+    """
+    def __init__(self, protocol: str = None, endpoint: str = None, bucket: str = None):
+        self.protocol = (protocol or 's3').lower()
+        self.bucket = bucket or os.getenv("ETL_BUCKET", "etl-bucket")
+        if self.protocol == 'file':
+            self.endpoint = os.path.abspath(endpoint or os.getenv("STORAGE_ROOT", ".storage"))
+            self.bucket = f'{self.endpoint}/{self.bucket}'
+        elif self.protocol == 'memory':
+            self.endpoint = None
+            self.bucket = f'/{self.bucket}'
         else:
-            raise ValueError(f"Unsupported protocol: {self.protocol!r}")
+            self.endpoint = endpoint or 'http://localhost:9000'
+
+        self.fs = get_filesystem(self.protocol, endpoint=self.endpoint)
 
     def slugify(self, text: str) -> str:
         """Converts 'Coffee Cup' to 'coffee_cup'."""
@@ -47,6 +177,9 @@ class CloudStorage:
     def store_data_parquet(self, dataframe: pd.DataFrame, path: str = '', partition_cols: List[str] = None, file_name: str = 'data.parquet'):
         path = f'{path.strip("/")}/' if path else ''
         target = f'{self.bucket}/{path}{file_name}'
+        if self.protocol == 'file':
+            # pandas hands local paths to pyarrow's own filesystem, which does not create parents
+            self.fs.makedirs(target.rsplit('/', 1)[0], exist_ok=True)
 
         if partition_cols:
             dataframe.to_parquet(
@@ -65,7 +198,24 @@ class CloudStorage:
             )
         logger.info(f'Stored DataFrame to {target}')
 
-    def load_parquet(self, path: str, file_name: str = None) -> pd.DataFrame:
+    @staticmethod
+    def _table_to_output(table: pa.Table, output: OutputFormat = 'pandas') -> pd.DataFrame | pa.Table:
+        if output == 'arrow':
+            return table
+        if output == 'pandas_arrow':
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        if output == 'pandas_self_destruct':
+            # The caller must not hold another reference to `table`, or the buffers cannot be released
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        if output == 'pandas':
+            return table.to_pandas()
+        raise ValueError(f"Unsupported output format: {output!r}")
+
+    @staticmethod
+    def _empty_output(output: OutputFormat = 'pandas') -> pd.DataFrame | pa.Table:
+        return pa.table({}) if output == 'arrow' else pd.DataFrame()
+
+    def load_parquet(self, path: str, file_name: str = None, output: OutputFormat = 'pandas') -> pd.DataFrame | pa.Table:
         if not path:
             raise ValueError("`path` must be provided and non-empty")
 
@@ -76,6 +226,10 @@ class CloudStorage:
 
         logger.debug(f'Loading parquet from {self.protocol}: {uri}')
         try:
+            if output != 'pandas':
+                result = self._table_to_output(pq.read_table(uri, filesystem=self.fs), output)
+                logger.info(f'Loaded {output} data from {uri} with {result.shape[0]} rows')
+                return result
             df = pd.read_parquet(
                 uri,
                 engine="pyarrow",
@@ -85,7 +239,33 @@ class CloudStorage:
             return df
         except Exception as e:
             logger.error(f'Error loading parquet from {self.protocol}: {e}')
-            return pd.DataFrame()
+            return self._empty_output(output)
+
+    def store_object(self, data: bytes, path: str, content_type: str = None, cache_control: str = None) -> str:
+        """Writes raw bytes to `path` in the bucket, with object metadata where the backend supports it. Returns the full key."""
+        target = f'{self.bucket}/{path.strip("/")}'
+        kwargs = {}
+        if self.protocol in ('gcs', 'gs'):
+            if content_type:
+                kwargs['content_type'] = content_type
+            if cache_control:
+                kwargs['fixed_key_metadata'] = {'cache_control': cache_control}
+        elif self.protocol == 's3':
+            if content_type:
+                kwargs['ContentType'] = content_type
+            if cache_control:
+                kwargs['CacheControl'] = cache_control
+        elif self.protocol == 'file':
+            self.fs.makedirs(target.rsplit('/', 1)[0], exist_ok=True)
+        self.fs.pipe_file(target, data, **kwargs)
+        logger.debug(f'Stored {len(data)} bytes to {self.protocol}: {target}')
+        return target
+
+    def load_object(self, path: str) -> bytes:
+        return self.fs.cat_file(f'{self.bucket}/{path.strip("/")}')
+
+    def object_exists(self, path: str) -> bool:
+        return self.fs.exists(f'{self.bucket}/{path.strip("/")}')
 
     def append_to_dataset_parquet(self, dataframe: pd.DataFrame, path: str, file_name: str):
         try:
@@ -124,63 +304,539 @@ class CloudStorage:
         return df
 
     @staticmethod
-    def _schema_from_df(df: pd.DataFrame, schema_hints: dict[str, pa.DataType] | None = None) -> pa.Schema:
-        table = pa.Table.from_pandas(df, preserve_index=False)
-        schema = table.schema
-        if not schema_hints:
-            return schema
+    def _schema_from_dtypes(df: pd.DataFrame, schema_hints: dict[str, pa.DataType] | None = None) -> pa.Schema:
+        """
+        Builds the Arrow write schema from column dtypes plus hints, without converting any data.
+        Object and string columns map to pa.string(), matching what _normalize_for_write produces.
+        """
+        schema_hints = schema_hints or {}
         fields: list[pa.Field] = []
-        for f in schema:
-            fields.append(pa.field(f.name, schema_hints[f.name]) if f.name in schema_hints else f)
+        for name, dtype in df.dtypes.items():
+            if name in schema_hints:
+                arrow_type = schema_hints[name]
+            elif dtype == object or pd.api.types.is_string_dtype(dtype):
+                arrow_type = pa.string()
+            elif isinstance(dtype, pd.ArrowDtype):
+                arrow_type = dtype.pyarrow_dtype
+            elif isinstance(dtype, pd.DatetimeTZDtype):
+                arrow_type = pa.timestamp(dtype.unit, tz=str(dtype.tz))
+            elif isinstance(dtype, np.dtype):
+                arrow_type = pa.from_numpy_dtype(dtype)
+            else:
+                # Remaining extension dtypes (categorical, nullable ints, ...) are rare; let pyarrow infer them
+                arrow_type = pa.Schema.from_pandas(df[[name]], preserve_index=False).field(name).type
+            fields.append(pa.field(name, arrow_type))
         return pa.schema(fields)
 
-    def load_dataset_parquet(self, path: str, columns: list[str] | None = None, schema_hints: dict[str, pa.DataType] | None = None) -> pd.DataFrame:
+    def _to_arrow(
+        self,
+        data: pd.DataFrame | pa.Table | pa.RecordBatchReader,
+        schema_hints: dict[str, pa.DataType] | None = None,
+    ) -> pa.Table | pa.RecordBatchReader:
+        """
+        Converts write input to Arrow exactly once. Tables and readers are only cast when the
+        hints (or all-null columns) require it; readers stay streaming.
+        """
+        if isinstance(data, pd.DataFrame):
+            schema = self._schema_from_dtypes(data, schema_hints=schema_hints)
+            try:
+                return pa.Table.from_pandas(data, preserve_index=False, schema=schema)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Object columns holding non-string values need the per-column string coercion
+                df = self._normalize_for_write(data.copy())
+                return pa.Table.from_pandas(df, preserve_index=False, schema=schema)
+
+        schema = self._promote_nulls_to_string(data.schema, hints=schema_hints)
+        if schema.equals(data.schema):
+            return data
+        return data.cast(schema)
+
+    # ---------- Dataset manifest ----------
+    # {'version': int, 'schema': base64 Arrow IPC schema, 'partition_cols': [...],
+    #  'files': [{'path': relative path, 'partition': {col: raw hive value}, 'num_rows': int,
+    #             'size': bytes, 'stats': {col: {'min': v, 'max': v, 'null_count': int, None if unknown}}}]}
+
+    @contextmanager
+    def _manifest_lock(self, base_dir: str):
+        """
+        Serializes manifest updates for a dataset: threads of this process on a local lock, then
+        processes on a lock file next to the manifest ('file') or a Redis lock (object stores).
+        The 'memory' backend is private to the process and needs neither. Without a reachable
+        Redis only the local lock applies, which is unsafe with several writers.
+        """
+        with _MANIFEST_LOCKS_GUARD:
+            local_lock = _MANIFEST_LOCKS.setdefault(base_dir, threading.Lock())
+        with local_lock:
+            if self.protocol == 'memory':
+                yield
+            elif self.protocol == 'file':
+                with self._file_lock(base_dir):
+                    yield
+            else:
+                with self._redis_lock(base_dir):
+                    yield
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(base_dir: str):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(base_dir, exist_ok=True)
+        deadline = time.monotonic() + MANIFEST_LOCK_WAIT
+        # The leading underscore keeps the lock file out of dataset discovery, like the manifest
+        with open(f'{base_dir}/{MANIFEST_LOCK_NAME}', 'a') as f:
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f'Timed out after {MANIFEST_LOCK_WAIT}s waiting for the manifest lock of {base_dir}')
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _redis_lock(self, base_dir: str):
+        global _manifest_lock_warned
+        lock = get_redis_client().lock(f'manifest-lock:{self.protocol}:{base_dir}', timeout=MANIFEST_LOCK_TIMEOUT, blocking_timeout=MANIFEST_LOCK_WAIT)
+        try:
+            acquired = lock.acquire()
+        except redis.RedisError as e:
+            if not _manifest_lock_warned:
+                _manifest_lock_warned = True
+                logger.warning(f'Redis unavailable for manifest locks ({e}); only writers in this process are serialized')
+            yield
+            return
+        if not acquired:
+            raise TimeoutError(f'Timed out after {MANIFEST_LOCK_WAIT}s waiting for the manifest lock of {base_dir}')
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                logger.warning(f'Manifest lock for {base_dir} expired before the update finished; raise MANIFEST_LOCK_TIMEOUT')
+            except redis.RedisError as e:
+                logger.warning(f'Could not release the manifest lock for {base_dir}: {e}')
+
+    @staticmethod
+    def _stat_value(v: Any) -> Any:
+        """Normalizes a statistic or filter value to something JSON-safe and order-preserving."""
+        if isinstance(v, datetime):
+            return (v.astimezone(timezone.utc) if v.tzinfo else v).isoformat()
+        if isinstance(v, date):
+            return v.isoformat()
+        if isinstance(v, bytes):
+            try:
+                return v.decode('utf-8')
+            except UnicodeDecodeError:
+                return None
+        if isinstance(v, np.generic):
+            return v.item()
+        return v
+
+    @staticmethod
+    def _encode_schema(schema: pa.Schema) -> str:
+        return base64.b64encode(schema.serialize().to_pybytes()).decode('ascii')
+
+    @staticmethod
+    def _decode_schema(encoded: str) -> pa.Schema:
+        return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(encoded)))
+
+    @staticmethod
+    def _hive_partition(rel_path: str) -> dict[str, str]:
+        partition = {}
+        for segment in rel_path.split('/')[:-1]:
+            if '=' in segment:
+                k, v = segment.split('=', 1)
+                partition[unquote(k)] = unquote(v)
+        return partition
+
+    @staticmethod
+    def _relative_path(base_dir: str, file_path: str) -> str:
+        base = base_dir.lstrip('/')
+        rel_path = file_path.lstrip('/')
+        return rel_path[len(base):].lstrip('/') if rel_path.startswith(base) else rel_path
+
+    def _manifest_entry(self, base_dir: str, file_path: str, metadata: Any, size: int | None = None) -> dict:
+        rel_path = self._relative_path(base_dir, file_path)
+        stats: dict[str, dict] = {}
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                column = row_group.column(j)
+                st = column.statistics
+                entry = stats.setdefault(column.path_in_schema, {'min': None, 'max': None, 'null_count': 0, 'complete': True})
+                # Counted before the min/max check: an all-null row group has a null count but no min/max
+                if entry['null_count'] is not None:
+                    entry['null_count'] = entry['null_count'] + st.null_count if st is not None and st.has_null_count else None
+                if st is None or not st.has_min_max:
+                    entry['complete'] = False
+                    continue
+                lo, hi = self._stat_value(st.min), self._stat_value(st.max)
+                try:
+                    entry['min'] = lo if entry['min'] is None else min(entry['min'], lo)
+                    entry['max'] = hi if entry['max'] is None else max(entry['max'], hi)
+                except TypeError:
+                    entry['complete'] = False
+        for col in list(stats):
+            if not stats[col].pop('complete') or stats[col]['min'] is None:
+                # Partial or unusable stats must not be used for pruning
+                stats[col] = {'null_count': stats[col]['null_count']}
+        return {
+            'path': rel_path,
+            'partition': self._hive_partition(rel_path),
+            'num_rows': metadata.num_rows,
+            'size': size,
+            'stats': stats,
+        }
+
+    def _read_manifest(self, base_dir: str) -> dict | None:
+        try:
+            with self.fs.open(f'{base_dir}/{MANIFEST_NAME}', 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, base_dir: str, manifest: dict) -> None:
+        """Publishes the manifest as one object, so readers see either the old or the new version."""
+        payload = json.dumps(manifest, separators=(',', ':'), default=str).encode('utf-8')
+        target = f'{base_dir}/{MANIFEST_NAME}'
+        if self.protocol == 'file':
+            tmp = f'{target}.tmp-{uuid.uuid4().hex}'
+            self.fs.pipe_file(tmp, payload)
+            self.fs.mv(tmp, target)
+        else:
+            self.fs.pipe_file(target, payload)
+
+    def _build_manifest(self, base_dir: str) -> dict | None:
+        """Lists the dataset and reads every footer; used to backfill or repair a manifest."""
+        if not self.fs.exists(base_dir):
+            return None
+        dataset = ds.dataset(base_dir, filesystem=self.fs, format='parquet', partitioning='hive', exclude_invalid_files=True)
+        files = []
+        for fragment in dataset.get_fragments():
+            files.append(self._manifest_entry(base_dir, fragment.path, fragment.metadata))
+        partition_cols = sorted({k for f in files for k in f['partition']})
+        return {'version': 0, 'schema': self._encode_schema(dataset.schema), 'partition_cols': partition_cols, 'files': files}
+
+    def rebuild_manifest(self, path: str) -> dict | None:
+        """
+        Rebuilds a dataset manifest from a full listing. Run after compaction, or after data
+        was written outside store_dataset_parquet.
+        """
+        base_dir = self._dataset_base_dir(path)
+        with self._manifest_lock(base_dir):
+            manifest = self._build_manifest(base_dir)
+            if manifest is None:
+                return None
+            previous = self._read_manifest(base_dir)
+            manifest['version'] = (previous or {}).get('version', 0) + 1
+            self._write_manifest(base_dir, manifest)
+        logger.info(f'Rebuilt manifest for {base_dir} with {len(manifest["files"])} files')
+        return manifest
+
+    def _update_manifest(self, base_dir: str, schema: pa.Schema, partition_cols: list[str] | None, written: list[dict], replaced: bool, existed: dict | None) -> None:
+        with self._manifest_lock(base_dir):
+            # Re-read under the lock so updates from other writers are kept
+            manifest = self._read_manifest(base_dir) or existed or {'version': 0, 'files': []}
+            files = manifest.get('files', [])
+            if replaced:
+                if partition_cols:
+                    touched = {tuple(sorted(f['partition'].items())) for f in written}
+                    files = [f for f in files if tuple(sorted(f['partition'].items())) not in touched]
+                else:
+                    files = []
+            written_paths = {f['path'] for f in written}
+            files = [f for f in files if f['path'] not in written_paths]
+            if manifest.get('schema') and files:
+                try:
+                    schema = pa.unify_schemas([self._decode_schema(manifest['schema']), schema], promote_options='permissive')
+                except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                    logger.warning(f'Schema change in {base_dir} could not be unified ({e}); keeping the new schema')
+            self._write_manifest(base_dir, {
+                'version': manifest.get('version', 0) + 1,
+                'schema': self._encode_schema(schema),
+                'partition_cols': list(partition_cols or manifest.get('partition_cols') or []),
+                'files': files + written,
+            })
+            self._check_manifest_drift(base_dir, files + written)
+
+    def _check_manifest_drift(self, base_dir: str, files: list[dict]) -> None:
+        """
+        Warns when the dataset holds files its manifest doesn't record, e.g. written outside
+        store_dataset_parquet: manifest scans skip them until rebuild_manifest runs. Files named by
+        store_dataset_parquet are left out, since a concurrent writer records its files only after
+        writing them.
+        """
+        recorded = {f['path'] for f in files}
+        unrecorded = []
+        for file_path in self.fs.find(base_dir):
+            rel_path = self._relative_path(base_dir, file_path)
+            # Same rule as dataset discovery: '_' and '.' prefixed entries aren't data
+            if rel_path in recorded or any(part.startswith(('_', '.')) for part in rel_path.split('/')):
+                continue
+            if not _DATASET_FILE_NAME.fullmatch(rel_path.rsplit('/', 1)[-1]):
+                unrecorded.append(rel_path)
+        if unrecorded:
+            logger.warning(
+                f'{len(unrecorded)} files in {base_dir} are not in its manifest and are skipped by manifest scans '
+                f'(e.g. {unrecorded[0]}); run rebuild_manifest'
+            )
+
+    def _partition_value(self, raw: str, arrow_type: pa.DataType) -> Any:
+        if raw == '__HIVE_DEFAULT_PARTITION__':
+            return None
+        return pa.scalar(raw).cast(arrow_type).as_py()
+
+    @staticmethod
+    def _overlaps(condition: Any, lo: Any, hi: Any) -> bool:
+        """True unless [lo, hi] provably cannot satisfy the condition."""
+        norm = CloudStorage._stat_value
+        try:
+            if isinstance(condition, tuple):
+                c_lo, c_hi = (norm(c) for c in condition)
+                return (c_lo is None or hi >= c_lo) and (c_hi is None or lo <= c_hi)
+            if isinstance(condition, (list, set)):
+                return any(lo <= norm(c) <= hi for c in condition)
+            return lo <= norm(condition) <= hi
+        except TypeError:
+            return True
+
+    def plan_dataset_scan(self, path: str, where: dict[str, Any] | None = None) -> list[dict] | None:
+        """
+        Plans a scan from the manifest alone: no listing and no footer reads.
+        args:
+            where: {column: value | [values] | (low, high)}; None bounds in a tuple are open
+        returns:
+            Manifest entries for the files that may hold matching rows, or None when the dataset
+            has no manifest.
+        """
+        base_dir = self._dataset_base_dir(path)
+        manifest = self._read_manifest(base_dir)
+        if manifest is None:
+            return None
+        files = manifest['files']
+        if not where:
+            return files
+        schema = self._decode_schema(manifest['schema'])
+        planned = []
+        for f in files:
+            keep = True
+            for col, condition in where.items():
+                if col in f['partition'] and col in schema.names:
+                    value = self._stat_value(self._partition_value(f['partition'][col], schema.field(col).type))
+                    keep = value is not None and self._overlaps(condition, value, value)
+                elif 'min' in f['stats'].get(col, {}):
+                    keep = self._overlaps(condition, f['stats'][col]['min'], f['stats'][col]['max'])
+                if not keep:
+                    break
+            if keep:
+                planned.append(f)
+        return planned
+
+    @staticmethod
+    def _where_expression(where: dict[str, Any]) -> ds.Expression:
+        expr = None
+        for col, condition in where.items():
+            field = ds.field(col)
+            if isinstance(condition, tuple):
+                lo, hi = condition
+                parts = [p for p in ((field >= lo) if lo is not None else None, (field <= hi) if hi is not None else None) if p is not None]
+                if not parts:
+                    continue
+                term = parts[0] if len(parts) == 1 else parts[0] & parts[1]
+            elif isinstance(condition, (list, set)):
+                term = field.isin(list(condition))
+            else:
+                term = field == condition
+            expr = term if expr is None else expr & term
+        return expr
+
+    def _dataset_from_manifest(self, base_dir: str, manifest: dict, files: list[dict], schema_hints: dict[str, pa.DataType] | None = None) -> ds.Dataset:
+        schema = self._promote_nulls_to_string(self._decode_schema(manifest['schema']), hints=schema_hints)
+        partitions = []
+        for f in files:
+            expr = ds.scalar(True)
+            for col, raw in f['partition'].items():
+                if col not in schema.names:
+                    continue
+                value = self._partition_value(raw, schema.field(col).type)
+                expr = expr & (ds.field(col).is_null() if value is None else ds.field(col) == pa.scalar(value, type=schema.field(col).type))
+            partitions.append(expr)
+        return ds.FileSystemDataset.from_paths(
+            [f'{base_dir}/{f["path"]}' for f in files],
+            schema=schema,
+            format=ds.ParquetFileFormat(),
+            filesystem=pafs.PyFileSystem(pafs.FSSpecHandler(self.fs)),
+            partitions=partitions,
+        )
+
+    def _scan_dataset(
+        self,
+        path: str,
+        columns: list[str] | None = None,
+        schema_hints: dict[str, pa.DataType] | None = None,
+        where: dict[str, Any] | None = None,
+    ) -> pa.Table:
         if not path:
             raise ValueError('`path` must be provided and non-empty')
 
         base_dir = self._dataset_base_dir(path)
+        row_filter = self._where_expression(where) if where else None
+
+        manifest = self._read_manifest(base_dir)
+        if manifest is not None and manifest.get('schema'):
+            files = self.plan_dataset_scan(path, where=where) if where else manifest['files']
+            try:
+                dataset = self._dataset_from_manifest(base_dir, manifest, files, schema_hints=schema_hints)
+                scanner = ds.Scanner.from_dataset(dataset=dataset, columns=columns, filter=row_filter, use_threads=True)
+                return scanner.to_table()
+            except (FileNotFoundError, OSError, pa.ArrowInvalid) as e:
+                logger.warning(f'Manifest for {base_dir} is stale ({e}); falling back to a listing scan')
+
+        ds0 = ds.dataset(
+            base_dir,
+            filesystem=self.fs,
+            format='parquet',
+            partitioning='hive',
+            exclude_invalid_files=True,
+        )
+        promoted_schema = self._promote_nulls_to_string(ds0.schema, hints=schema_hints)
+        dataset = ds.dataset(
+            base_dir,
+            filesystem=self.fs,
+            format='parquet',
+            partitioning='hive',
+            exclude_invalid_files=True,
+            schema=promoted_schema,
+        )
+        scanner = ds.Scanner.from_dataset(dataset=dataset, columns=columns, filter=row_filter, use_threads=True)
+        return scanner.to_table()
+
+    def load_dataset_parquet(
+        self,
+        path: str,
+        columns: list[str] | None = None,
+        schema_hints: dict[str, pa.DataType] | None = None,
+        output: OutputFormat = 'pandas',
+        where: dict[str, Any] | None = None,
+    ) -> pd.DataFrame | pa.Table:
+        """
+        Loads a hive-partitioned dataset. When the dataset has a manifest, files are planned from
+        it instead of listing the prefix.
+        args:
+            where: optional row filter, {column: value | [values] | (low, high)}. Files whose
+                partition values or min/max statistics cannot match are skipped.
+        """
+        if not path:
+            raise ValueError('`path` must be provided and non-empty')
 
         try:
-            ds0 = ds.dataset(
-                base_dir,
-                filesystem=self.fs,
-                format='parquet',
-                partitioning='hive',
-                exclude_invalid_files=True,
-            )
-            promoted_schema = self._promote_nulls_to_string(ds0.schema, hints=schema_hints)
-            dataset = ds.dataset(
-                base_dir,
-                filesystem=self.fs,
-                format='parquet',
-                partitioning='hive',
-                exclude_invalid_files=True,
-                schema=promoted_schema,
-            )
-            scanner = ds.Scanner.from_dataset(dataset=dataset, columns=columns, use_threads=True)
-            return scanner.to_table().to_pandas()
+            return self._table_to_output(self._scan_dataset(path, columns=columns, schema_hints=schema_hints, where=where), output)
         except Exception as e:
-            logger.error(f'Error loading dataset from {base_dir}: {e}')
-            return pd.DataFrame()
+            logger.error(f'Error loading dataset from {self._dataset_base_dir(path)}: {e}')
+            return self._empty_output(output)
+
+    @staticmethod
+    def _run_batch(fn, items: list, max_workers: int | None = None) -> list[dict]:
+        """
+        Runs fn over items on a bounded thread pool. Results come back in input order as
+        {'result': ..., 'error': None} or {'result': None, 'error': '...'}; one failing item
+        never aborts the others.
+        """
+        def run_one(item):
+            try:
+                return {'result': fn(item), 'error': None}
+            except Exception as e:
+                return {'result': None, 'error': f'{type(e).__name__}: {e}'}
+
+        if not items:
+            return []
+        workers = max(1, min(max_workers or STORAGE_IO_WORKERS, len(items)))
+        if workers == 1:
+            return [run_one(item) for item in items]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cloud-storage') as pool:
+            return list(pool.map(run_one, items))
+
+    def load_datasets_parquet(
+        self,
+        paths: list[str],
+        columns: list[str] | dict[str, list[str]] | None = None,
+        schema_hints: dict[str, pa.DataType] | None = None,
+        max_workers: int | None = None,
+        output: OutputFormat = 'pandas',
+    ) -> list[dict]:
+        """
+        Loads several datasets concurrently, so the total wait is roughly that of the slowest one.
+        args:
+            paths: dataset paths, as accepted by load_dataset_parquet
+            columns: one column list for every path, or a {path: columns} mapping
+            max_workers: thread pool size, defaults to STORAGE_IO_WORKERS
+            output: return type for each dataset, see OutputFormat
+        returns:
+            One {'path', 'data', 'error'} dict per path, in input order. 'data' is empty
+            when 'error' is set.
+        """
+        def load_one(p: str) -> pd.DataFrame | pa.Table:
+            cols = columns.get(p) if isinstance(columns, dict) else columns
+            return self._table_to_output(self._scan_dataset(p, columns=cols, schema_hints=schema_hints), output)
+
+        results = self._run_batch(load_one, list(paths), max_workers=max_workers)
+        out = []
+        for p, r in zip(paths, results):
+            if r['error']:
+                logger.error(f'Error loading dataset from {self._dataset_base_dir(p or "")}: {r["error"]}')
+            out.append({
+                'path': p,
+                'data': r['result'] if r['result'] is not None else self._empty_output(output),
+                'error': r['error'],
+            })
+        return out
 
     def store_dataset_parquet(
         self,
-        dataframe: pd.DataFrame,
+        dataframe: pd.DataFrame | pa.Table | pa.RecordBatchReader,
         path: str,
         partition_cols: list[str] | None = None,
         schema_hints: dict[str, pa.DataType] | None = None,
         mode: Literal['append', 'overwrite_or_ignore', 'delete_matching'] = 'append',
         logger: logging.Logger | None = None,
+        sort_by: list[str] | None = None,
+        row_group_rows: int | None = PARQUET_ROW_GROUP_ROWS,
+        target_file_bytes: int | None = None,
+        use_dictionary: bool | list[str] = True,
+        write_page_index: bool = True,
     ) -> None:
-        if dataframe is None or dataframe.empty:
+        """
+        Writes a hive-partitioned parquet dataset.
+        args:
+            dataframe: a DataFrame, a pa.Table, or a pa.RecordBatchReader for streaming writes
+                that never hold the whole dataset in memory
+            sort_by: columns to cluster rows by before writing (e.g. ['date', 'video_title']), so each
+                row group covers a narrow min/max range. Requires a DataFrame or pa.Table.
+            row_group_rows: target rows per row group; None keeps pyarrow's default (capped at the
+                rows per file when target_file_bytes is set)
+            target_file_bytes: approximate file size, estimated from in-memory (uncompressed) row
+                width, so files on disk come out smaller. Ignored for RecordBatchReader input.
+            use_dictionary: dictionary-encode all columns, or only the listed ones
+            write_page_index: write column/offset indexes so readers can skip pages within a row group
+        """
+        if dataframe is None or (isinstance(dataframe, pd.DataFrame) and dataframe.empty) or (isinstance(dataframe, pa.Table) and dataframe.num_rows == 0):
             if logger:
                 logger.warning(f"Skipping storage for {path}: DataFrame is empty.")
             return
 
-        df = self._normalize_for_write(dataframe.copy())
         base_dir = self._dataset_base_dir(path)
-        schema = self._schema_from_df(df, schema_hints=schema_hints)
-        table = pa.Table.from_pandas(df, preserve_index=False, schema=schema)
+        table = self._to_arrow(dataframe, schema_hints=schema_hints)
+        if sort_by:
+            if not isinstance(table, pa.Table):
+                raise ValueError('`sort_by` requires a DataFrame or pa.Table, not a streaming reader')
+            table = table.sort_by([(c, 'ascending') for c in sort_by])
 
         behavior_map = {
             'append': 'overwrite_or_ignore',
@@ -193,28 +849,90 @@ class CloudStorage:
 
         write_kwargs['basename_template'] = f'part-{{i}}-{uuid.uuid4().hex}.parquet'
 
+        if target_file_bytes and isinstance(table, pa.Table) and table.num_rows:
+            bytes_per_row = max(1, table.nbytes // table.num_rows)
+            write_kwargs['max_rows_per_file'] = max(1, target_file_bytes // bytes_per_row)
+        if row_group_rows:
+            group_rows = min(row_group_rows, write_kwargs.get('max_rows_per_file', row_group_rows))
+            write_kwargs['max_rows_per_group'] = group_rows
+            write_kwargs['min_rows_per_group'] = group_rows
+        elif 'max_rows_per_file' in write_kwargs:
+            # pyarrow rejects row groups larger than a file, so cap its default group size too
+            write_kwargs['max_rows_per_group'] = min(PYARROW_MAX_ROWS_PER_GROUP, write_kwargs['max_rows_per_file'])
+        write_kwargs['file_options'] = ds.ParquetFileFormat().make_write_options(
+            use_dictionary=use_dictionary,
+            write_page_index=write_page_index,
+        )
+
         partitioning = None
         if partition_cols:
             part_schema = pa.schema([table.schema.field(c) for c in partition_cols])
             partitioning = ds.partitioning(part_schema, flavor='hive')
 
+        # Capture the pre-write state so a dataset written before manifests existed is backfilled
+        existed = None
+        if self._read_manifest(base_dir) is None:
+            existed = self._build_manifest(base_dir)
+
+        written: list[dict] = []
         ds.write_dataset(
             data=table,
             base_dir=base_dir,
             filesystem=self.fs,
             format='parquet',
             partitioning=partitioning,
+            file_visitor=lambda wf: written.append(self._manifest_entry(base_dir, wf.path, wf.metadata, getattr(wf, 'size', None))),
             **write_kwargs
         )
+        self._update_manifest(
+            base_dir,
+            schema=table.schema,
+            partition_cols=partition_cols,
+            written=written,
+            replaced=write_kwargs.get('existing_data_behavior') == 'delete_matching',
+            existed=existed,
+        )
 
     def append_dataset_parquet(
         self,
-        dataframe: pd.DataFrame,
+        dataframe: pd.DataFrame | pa.Table | pa.RecordBatchReader,
         path: str,
         partition_cols: list[str] | None = None,
         schema_hints: dict[str, pa.DataType] | None = None,
         replace_partitions: bool = False,
         logger: logging.Logger | None = None,
+        sort_by: list[str] | None = None,
+        row_group_rows: int | None = PARQUET_ROW_GROUP_ROWS,
+        target_file_bytes: int | None = None,
+        use_dictionary: bool | list[str] = True,
+        write_page_index: bool = True,
     ):
         mode = 'delete_matching' if replace_partitions and partition_cols else 'append'
-        self.store_dataset_parquet(dataframe=dataframe, path=path, partition_cols=partition_cols, schema_hints=schema_hints, mode=mode, logger=logger)
\ No newline at end of file
+        self.store_dataset_parquet(
+            dataframe=dataframe, path=path, partition_cols=partition_cols, schema_hints=schema_hints, mode=mode, logger=logger,
+            sort_by=sort_by, row_group_rows=row_group_rows, target_file_bytes=target_file_bytes,
+            use_dictionary=use_dictionary, write_page_index=write_page_index,
+        )
+
+    def store_datasets_parquet(self, writes: list[dict], max_workers: int | None = None) -> list[dict]:
+        """
+        Writes several DataFrames concurrently.
+        args:
+            writes: list of keyword dicts for store_dataset_parquet, e.g.
+                {'dataframe': df, 'path': 'traffic/daily', 'partition_cols': ['date'], 'mode': 'delete_matching'}
+                Entries should target distinct paths (or disjoint partitions), since writes to the
+                same location are not ordered relative to each other.
+            max_workers: thread pool size, defaults to STORAGE_IO_WORKERS
+        returns:
+            One {'path', 'error'} dict per entry, in input order.
+        """
+        def store_one(kwargs: dict) -> None:
+            self.store_dataset_parquet(**kwargs)
+
+        results = self._run_batch(store_one, list(writes), max_workers=max_workers)
+        out = []
+        for w, r in zip(writes, results):
+            if r['error']:
+                logger.error(f'Error storing dataset to {w.get("path")}: {r["error"]}')
+            out.append({'path': w.get('path'), 'error': r['error']})
+        return out
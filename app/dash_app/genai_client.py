@@ -0,0 +1,188 @@
+import os
+import time
+import random
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+import httpx
+from google import genai
+from google.genai import types, errors as genai_errors
+
+"""
+Shared Gemini client
+
+genai.Client owns an httpx connection pool, so building one per call throws away keep-alive
+connections and pays a fresh TLS handshake on every AI request. get_genai_client() lazily creates
+one client per API key per process (again in each forked Celery/gunicorn worker) and reuses it.
+
+call_model() is the shared resilience layer for model requests: it retries transient failures
+(429/5xx, timeouts, connection errors) with full-jitter exponential backoff inside an overall
+deadline, and can optionally hedge a slow request by sending a duplicate once it has run longer
+than the recent p95 latency for that operation, taking whichever answers first. Wrap only the
+model request (and any parsing that decides whether the answer is usable), never the UI work built
+from it. stream_model() does the same for streaming requests, up to their first chunk.
+
+Settings (env):
+	GEMINI_TIMEOUT_MS              per-request timeout in milliseconds (default 120000)
+	GEMINI_MAX_CONNECTIONS         httpx pool size per process (default 10)
+	GEMINI_KEEPALIVE_EXPIRY        seconds an idle connection is kept open (default 120)
+	GEMINI_DEADLINE                default overall deadline per call_model() in seconds (default 90)
+	GEMINI_RETRY_ATTEMPTS          attempts per call_model(), including the first (default 3)
+	GEMINI_RETRY_BASE_DELAY        backoff base in seconds (default 0.5)
+	GEMINI_RETRY_MAX_DELAY         backoff cap in seconds (default 8)
+	GEMINI_HEDGE                   'true' to hedge by default (default false)
+	GEMINI_HEDGE_PERCENTILE        latency percentile that triggers a hedge (default 95)
+	GEMINI_HEDGE_MIN_SAMPLES       successful calls needed before hedging an operation (default 20)
+"""
+
+logger = logging.getLogger(__name__)
+
+GEMINI_TIMEOUT_MS = int(os.getenv('GEMINI_TIMEOUT_MS', '120000'))
+GEMINI_MAX_CONNECTIONS = int(os.getenv('GEMINI_MAX_CONNECTIONS', '10'))
+GEMINI_KEEPALIVE_EXPIRY = float(os.getenv('GEMINI_KEEPALIVE_EXPIRY', '120'))
+GEMINI_DEADLINE = float(os.getenv('GEMINI_DEADLINE', '90'))
+GEMINI_RETRY_ATTEMPTS = int(os.getenv('GEMINI_RETRY_ATTEMPTS', '3'))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv('GEMINI_RETRY_BASE_DELAY', '0.5'))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv('GEMINI_RETRY_MAX_DELAY', '8'))
+GEMINI_HEDGE = os.getenv('GEMINI_HEDGE', 'false').lower() == 'true'
+GEMINI_HEDGE_PERCENTILE = float(os.getenv('GEMINI_HEDGE_PERCENTILE', '95'))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', '20'))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (TimeoutError, httpx.TimeoutException, httpx.TransportError)
+
+_clients: dict[str, genai.Client] = {}
+_clients_lock = threading.Lock()
+_clients_pid = {'pid': os.getpid()}
+_executor: ThreadPoolExecutor | None = None
+_latencies: dict[str, deque] = {}
+
+def _reset_after_fork() -> None:
+	global _clients_lock, _executor
+	_clients.clear()
+	_clients_lock = threading.Lock()
+	_clients_pid['pid'] = os.getpid()
+	# The parent's executor threads don't exist in the child
+	_executor = None
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_genai_client(api_key: str) -> genai.Client:
+	"""Returns the process-wide client for `api_key`, creating it on first use. Thread-safe."""
+	if _clients_pid['pid'] != os.getpid():
+		_reset_after_fork()
+	client = _clients.get(api_key)
+	if client is not None:
+		return client
+	with _clients_lock:
+		client = _clients.get(api_key)
+		if client is None:
+			client = genai.Client(
+				api_key=api_key,
+				http_options=types.HttpOptions(
+					timeout=GEMINI_TIMEOUT_MS,
+					client_args={
+						'limits': httpx.Limits(
+							max_connections=GEMINI_MAX_CONNECTIONS,
+							max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+							keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+						),
+					},
+				),
+			)
+			# A rotated key replaces the old client rather than accumulating them
+			_clients.clear()
+			_clients[api_key] = client
+			logger.info(f'Created Gemini client (pid {os.getpid()})')
+		return client
+
+def _get_executor() -> ThreadPoolExecutor:
+	global _executor
+	if _clients_pid['pid'] != os.getpid():
+		_reset_after_fork()
+	if _executor is None:
+		with _clients_lock:
+			if _executor is None:
+				# Room for one hedge per pooled connection
+				_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONNECTIONS * 2, thread_name_prefix='genai')
+	return _executor
+
+def _record_latency(name: str, seconds: float) -> None:
+	_latencies.setdefault(name, deque(maxlen=200)).append(seconds)
+
+def latency_percentile(name: str, percentile: float = GEMINI_HEDGE_PERCENTILE) -> float | None:
+	"""Recent successful-call latency for `name` at `percentile`, or None until GEMINI_HEDGE_MIN_SAMPLES calls have completed."""
+	samples = sorted(_latencies.get(name, ()))
+	if len(samples) < GEMINI_HEDGE_MIN_SAMPLES:
+		return None
+	return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+def _is_retryable(e: Exception, retry_on: tuple) -> bool:
+	if isinstance(e, genai_errors.APIError):
+		return e.code in RETRYABLE_STATUS
+	return isinstance(e, RETRYABLE_ERRORS + retry_on)
+
+def _attempt(fn, name: str, timeout: float, hedge: bool):
+	start = time.monotonic()
+	futures = [_get_executor().submit(fn)]
+	hedge_after = latency_percentile(name) if hedge else None
+	if hedge_after is not None and hedge_after < timeout:
+		done, _ = wait(futures, timeout=hedge_after)
+		if not done:
+			logger.info(f'{name}: no response after p{GEMINI_HEDGE_PERCENTILE:g} ({hedge_after:.1f}s), sending hedged request')
+			futures.append(_get_executor().submit(fn))
+	error = None
+	for future in as_completed(futures, timeout=max(0, timeout - (time.monotonic() - start))):
+		try:
+			result = future.result()
+		except Exception as e:
+			error = e
+			continue
+		_record_latency(name, time.monotonic() - start)
+		return result
+	raise error
+
+def call_model(fn, name: str = 'genai', deadline: float | None = None, attempts: int | None = None, retry_on: tuple = (), hedge: bool | None = None):
+	"""
+	Runs `fn()` (one model request) with deadline-aware, jittered retries and optional hedging.
+	`name` groups latency samples for hedging; `retry_on` adds exception types worth retrying
+	(e.g. ValueError for unparseable responses). Non-retryable errors are raised immediately, and
+	the last error is raised once attempts or the deadline run out.
+	"""
+	deadline_at = time.monotonic() + (deadline if deadline is not None else GEMINI_DEADLINE)
+	attempts = attempts or GEMINI_RETRY_ATTEMPTS
+	hedge = GEMINI_HEDGE if hedge is None else hedge
+	last_error = None
+	for attempt in range(attempts):
+		remaining = deadline_at - time.monotonic()
+		if remaining <= 0:
+			break
+		try:
+			return _attempt(fn, name, remaining, hedge)
+		except Exception as e:
+			if not _is_retryable(e, retry_on):
+				raise
+			last_error = e
+		delay = random.uniform(0, min(GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BASE_DELAY * 2 ** attempt))
+		if attempt == attempts - 1 or time.monotonic() + delay >= deadline_at:
+			break
+		logger.warning(f'{name}: attempt {attempt + 1}/{attempts} failed ({last_error!r}), retrying in {delay:.2f}s')
+		time.sleep(delay)
+	raise last_error or TimeoutError(f'{name}: deadline exceeded')
+
+def stream_model(fn, name: str = 'genai', deadline: float | None = None, attempts: int | None = None, retry_on: tuple = ()):
+	"""
+	call_model() for streaming requests: `fn()` opens a response stream (e.g. generate_content_stream),
+	and retries cover everything up to its first chunk, which is when the request is actually sent.
+	Later chunks are yielded as they arrive; an error mid-stream is raised to the caller, since part
+	of the response has already been consumed. Never hedged: the losing stream would hold its
+	connection open.
+	"""
+	def first_chunk():
+		stream = iter(fn())
+		return stream, next(stream, None)
+	stream, first = call_model(first_chunk, name=name, deadline=deadline, attempts=attempts, retry_on=retry_on, hedge=False)
+	return stream if first is None else itertools.chain([first], stream)
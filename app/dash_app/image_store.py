@@ -0,0 +1,162 @@
+import os
+import io
+import re
+import base64
+import hashlib
+import logging
+import threading
+import flask
+from dash_app.cloud_storage import CloudStorage
+try:
+	from PIL import Image, features as pil_features
+except ImportError:
+	Image = None
+
+"""
+Content-addressed storage for generated images
+
+Generated images are written once to CloudStorage under the SHA-256 of their bytes and referenced
+by URL, so callback results (and the Celery result backend they pass through) carry a short URL
+instead of a multi-megabyte base64 data URI. Since a name can only ever refer to the same bytes,
+they are served with a year-long immutable Cache-Control header.
+
+store_image_variants() additionally transcodes each image (Pillow) to WebP or AVIF at a few widths,
+so pages show a small display-sized copy first and load the original only on demand. It runs
+wherever the image was generated, i.e. inside the Celery worker executing the background callback.
+
+Settings (env):
+	IMAGE_STORE_PROTOCOL     CloudStorage protocol (default 'gcs' when GCS_BUCKET_NAME is set, else 'file')
+	IMAGE_STORE_BUCKET       bucket name (default GCS_BUCKET_NAME, else 'generated-images')
+	IMAGE_STORE_ROOT         local root for the 'file' protocol (default STORAGE_ROOT, else app/.storage);
+	                         the web and worker processes must share it
+	IMAGE_PUBLIC_BASE_URL    serve straight from a public bucket/CDN at this URL instead of IMAGE_ROUTE
+	IMAGE_CACHE_MAX_AGE      Cache-Control max-age in seconds (default 31536000)
+	IMAGE_VARIANT_WIDTHS     comma-separated variant widths in px (default '320,800'); never upscaled
+	IMAGE_VARIANT_FORMAT     'webp' or 'avif' (default 'webp'; avif needs a Pillow build with AVIF)
+	IMAGE_VARIANT_QUALITY    encoder quality 1-100 (default 80)
+"""
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_PROTOCOL = os.getenv('IMAGE_STORE_PROTOCOL', 'gcs' if os.getenv('GCS_BUCKET_NAME') else 'file')
+IMAGE_STORE_BUCKET = os.getenv('IMAGE_STORE_BUCKET', os.getenv('GCS_BUCKET_NAME', 'generated-images'))
+# Anchored to the app directory (not the working directory) so the web server and a worker started
+# elsewhere, e.g. with --workdir app, read and write the same files
+IMAGE_STORE_ROOT = os.getenv('IMAGE_STORE_ROOT') or os.getenv('STORAGE_ROOT') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.storage')
+IMAGE_PUBLIC_BASE_URL = os.getenv('IMAGE_PUBLIC_BASE_URL', '').rstrip('/')
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '320,800').split(',') if w.strip()]
+IMAGE_VARIANT_FORMAT = os.getenv('IMAGE_VARIANT_FORMAT', 'webp').lower()
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', '80'))
+IMAGE_ROUTE = '/generated-images'
+IMAGE_PREFIX = 'generated_images'
+
+CACHE_CONTROL = f'public, max-age={IMAGE_CACHE_MAX_AGE}, immutable'
+EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp', 'image/avif': 'avif', 'image/gif': 'gif'}
+MIME_TYPES = {ext: mime for mime, ext in EXTENSIONS.items()}
+NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.(png|jpg|webp|avif|gif)$')
+
+_storage = {'pid': None, 'client': None}
+_storage_lock = threading.Lock()
+
+def _get_storage() -> CloudStorage:
+	if _storage['pid'] != os.getpid():
+		with _storage_lock:
+			if _storage['pid'] != os.getpid():
+				# IMAGE_STORE_ROOT is a local directory; object stores keep CloudStorage's own endpoint
+				endpoint = IMAGE_STORE_ROOT if IMAGE_STORE_PROTOCOL == 'file' else None
+				_storage['client'] = CloudStorage(protocol=IMAGE_STORE_PROTOCOL, endpoint=endpoint, bucket=IMAGE_STORE_BUCKET)
+				_storage['pid'] = os.getpid()
+	return _storage['client']
+
+def _key(name: str) -> str:
+	# Two-character fan-out keeps any one directory/prefix small
+	return f'{IMAGE_PREFIX}/{name[:2]}/{name}'
+
+def image_url(name: str) -> str:
+	if IMAGE_PUBLIC_BASE_URL:
+		return f'{IMAGE_PUBLIC_BASE_URL}/{_key(name)}'
+	return f'{IMAGE_ROUTE}/{name}'
+
+def store_image(data: bytes, mime_type: str | None = None) -> str:
+	"""Stores `data` under its content hash (skipping the write if it already exists) and returns its URL."""
+	mime_type = mime_type or 'image/png'
+	name = f'{hashlib.sha256(data).hexdigest()}.{EXTENSIONS.get(mime_type, "png")}'
+	storage = _get_storage()
+	key = _key(name)
+	if not storage.object_exists(key):
+		storage.store_object(data, key, content_type=mime_type, cache_control=CACHE_CONTROL)
+		logger.info(f'Stored generated image {name} ({len(data):,} bytes)')
+	return image_url(name)
+
+def store_image_or_data_uri(data: bytes, mime_type: str | None = None) -> str:
+	"""store_image(), falling back to an inline data URI if storage is unavailable."""
+	try:
+		return store_image(data, mime_type)
+	except Exception as e:
+		logger.warning(f'Image store unavailable, falling back to data URI: {e}')
+		return f"data:{mime_type or 'image/png'};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def image_variants_for(url: str) -> dict:
+	"""Variants dict for an image that has only one copy (placeholders, data URI fallbacks)."""
+	return {'full': url, 'display': url, 'thumb': url, 'srcset': None}
+
+def transcode_image(data: bytes, widths: list[int] | None = None) -> list[tuple[int, bytes, str]]:
+	"""Re-encodes `data` at each width (capped at the original width). Returns [(width, bytes, mime type)], narrowest first."""
+	if IMAGE_VARIANT_FORMAT == 'avif' and pil_features.check('avif'):
+		fmt, mime_type = 'AVIF', 'image/avif'
+	else:
+		fmt, mime_type = 'WEBP', 'image/webp'
+	variants = []
+	with Image.open(io.BytesIO(data)) as img:
+		img.load()
+		if img.mode not in ('RGB', 'RGBA'):
+			img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+		for width in sorted({min(w, img.width) for w in (widths or IMAGE_VARIANT_WIDTHS)}):
+			resized = img if width == img.width else img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+			buffer = io.BytesIO()
+			resized.save(buffer, format=fmt, quality=IMAGE_VARIANT_QUALITY)
+			variants.append((width, buffer.getvalue(), mime_type))
+	return variants
+
+def store_image_variants(data: bytes, mime_type: str | None = None) -> dict:
+	"""
+	Stores the original plus transcoded variants. Returns URLs for each:
+		full      the original bytes
+		display   the widest variant, for inline display
+		thumb     the narrowest variant
+		srcset    '<url> <width>w, ...' over all variants, for <img srcset>
+	Falls back to the original for every size if Pillow is missing or transcoding fails.
+	"""
+	full = store_image_or_data_uri(data, mime_type)
+	if Image is None or full.startswith('data:'):
+		return image_variants_for(full)
+	try:
+		variants = [(width, store_image(encoded, variant_type)) for width, encoded, variant_type in transcode_image(data)]
+	except Exception as e:
+		logger.warning(f'Image transcoding failed, serving original only: {e}')
+		return image_variants_for(full)
+	return {
+		'full': full,
+		'display': variants[-1][1],
+		'thumb': variants[0][1],
+		'srcset': ', '.join(f'{url} {width}w' for width, url in variants),
+	}
+
+def load_image(name: str) -> tuple[bytes, str]:
+	"""Returns (bytes, mime type) for a stored image name. Raises ValueError for names that aren't content hashes."""
+	if not NAME_PATTERN.match(name):
+		raise ValueError(f'Invalid image name: {name}')
+	return _get_storage().load_object(_key(name)), MIME_TYPES[name.rsplit('.', 1)[1]]
+
+def register_image_route(server: flask.Flask) -> None:
+	@server.route(f'{IMAGE_ROUTE}/<name>')
+	def generated_image(name):
+		try:
+			data, mime_type = load_image(name)
+		except (ValueError, FileNotFoundError):
+			flask.abort(404)
+		response = flask.Response(data, mimetype=mime_type)
+		response.headers['Cache-Control'] = CACHE_CONTROL
+		response.set_etag(name.split('.', 1)[0])
+		return response.make_conditional(flask.request)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import os, json, random, re, base64, io, uuid, time, socket, calendar, logging
+import os, json, random, re, io, uuid, time, socket, calendar, logging
 import pathlib
 from dotenv import load_dotenv, find_dotenv
 import dash
@@ -15,19 +15,28 @@ import plotly.express as px
 import pandas as pd
 import numpy as np
 from datetime import date, datetime
-from google import genai
 from google.genai import types
 from conf import GlobalUInterface
 from dash_app.utils import load_secret
+from dash_app.genai_client import get_genai_client, call_model
+from dash_app.prompt_cache import PromptCache
+from dash_app.palette_index import PaletteIndex
+from dash_app.image_store import store_image_variants, image_variants_for
+from redis_pool import get_redis_client
 
 # Get environment variables
 load_dotenv(find_dotenv())
 PAGE = 'ai'
 REDIS_URL = os.environ['REDIS_URL']
+COLOR_MODEL = 'gemini-3-flash-preview'
 pd.set_option('future.no_silent_downcasting', True)
 
 logger = logging.getLogger(__name__)
 
+IMAGE_PLACEHOLDER = 'assets/images/placeholder.png'
+palette_cache = PromptCache('color-palette', redis_client=get_redis_client(REDIS_URL))
+_palette_index = None
+
 class UInterface:
 	def __init__(self):
 		self.global_ui = GlobalUInterface()
@@ -137,6 +146,8 @@ class UInterface:
 								dcc.Loading(
 									id='ai-chart-loading',
 									children=[
+										html.Div(id='ai-colors-alert'),
+										# Rendered once; themes are applied as a recolor Patch on this figure
 										dbc.Container([
 											dashboard_ui().render_summary_charts(w=None, h=400, chart_only=True),
 										], id='ai-chart-container', fluid=True)
@@ -255,19 +266,32 @@ class UInterface:
 		])
 
 	def ai_color_sequence(self, input_prompt):
+		global _palette_index
+		if _palette_index is None:
+			_palette_index = PaletteIndex(self.global_ui.colors)
+		match = _palette_index.match(input_prompt)
+		if match:
+			logger.info(f"Palette prompt answered locally by {match['palette']} (confidence {match['confidence']})")
+			return match['colors']
+		cached = palette_cache.get(input_prompt, COLOR_MODEL)
+		if cached:
+			return cached
+		return self._generate_color_sequence(input_prompt)
+
+	def _generate_color_sequence(self, input_prompt):
 		api_key = load_secret("GEMINI_API_KEY")
 		if api_key:
 			print(f"DEBUG: GEMINI_API_KEY loaded. Length: {len(api_key)}")
 			api_key = api_key.strip()
 		else:
 			print("ERROR: GEMINI_API_KEY is None or empty.")
-		client = genai.Client(api_key=api_key)
+		client = get_genai_client(api_key)
 		
 		sys_instruction = "You are a graphic design artist. Write code to represent the colors and styles provided by user prompt as python objects. Please return a valid JSON string containing a python list containing 12 hex color code values based on the user's prompt. The list must be sorted in order of colors most to least representative of the prompt. Very light shades of white cannot be used. Include only this JSON string in your response."
 		
-		try:
+		def request():
 			response = client.models.generate_content(
-				model="gemini-3-flash-preview",
+				model=COLOR_MODEL,
 				contents=[
 					types.Content(
 						role="user",
@@ -280,20 +304,31 @@ class UInterface:
 					response_mime_type="application/json",
 				)
 			)
-			import json
-			data = json.loads(response.text)
-			if isinstance(data, list):
-				return data
-			if isinstance(data, dict):
-				for v in data.values():
-					if isinstance(v, list):
-						return v
+			return self._parse_colors(response.text)
+
+		try:
+			# Unusable answers (bad JSON, too few hex codes) are retried along with transient API errors
+			colors = call_model(request, name='color-palette', retry_on=(ValueError,))
 		except Exception as e:
 			logger.error(f"Error generating colors: {e}")
-		
-		return []
+			return []
+		palette_cache.set(input_prompt, COLOR_MODEL, colors)
+		return colors
+
+	def _parse_colors(self, text):
+		data = json.loads(text)
+		colors = []
+		if isinstance(data, list):
+			colors = data
+		elif isinstance(data, dict):
+			colors = next((v for v in data.values() if isinstance(v, list)), [])
+		colors = [c for c in colors if isinstance(c, str) and re.fullmatch(r'#[0-9a-fA-F]{6}', c.strip())]
+		# The summary charts use the first four colors
+		if len(colors) < 4:
+			raise ValueError(f'Expected at least 4 hex colors, got {len(colors)}')
+		return [c.strip() for c in colors]
 
-	def ai_generate_image(self, input_prompt:str,style='synthwave')->str:
+	def ai_generate_image(self, input_prompt:str,style='synthwave')->dict:
 		logger.info(f'Generating image with prompt: {input_prompt} | style: {style}')
 		api_key = load_secret("GEMINI_API_KEY")
 		if api_key:
@@ -301,7 +336,7 @@ class UInterface:
 			api_key = api_key.strip()
 		else:
 			logger.error("GEMINI_API_KEY is None or empty.")
-		client = genai.Client(api_key=api_key)
+		client = get_genai_client(api_key)
 
 		prompt = None
 		if style == 'synthwave':
@@ -347,7 +382,7 @@ class UInterface:
 		logger.info(f'Sending prompt to LLM: {prompt}')
 		
 		try:
-			response = client.models.generate_content(
+			response = call_model(lambda: client.models.generate_content(
 				model="gemini-3-pro-image-preview",
 				contents=[
 					types.Content(
@@ -363,18 +398,15 @@ class UInterface:
 					),
 					response_modalities=["IMAGE"],
 				)
-			)
+			), name='image')
 			if response.parts:
 				for part in response.parts:
 					if part.inline_data and part.inline_data.data:
-						image_bytes = part.inline_data.data
-						mime_type = part.inline_data.mime_type
-						b64_image = base64.b64encode(image_bytes).decode('utf-8')
-						return f"data:{mime_type};base64,{b64_image}"
-			return "assets/images/placeholder.png"
+						return store_image_variants(part.inline_data.data, part.inline_data.mime_type)
+			return image_variants_for(IMAGE_PLACEHOLDER)
 		except Exception as e:
 			logger.error(f"Error generating image: {e}")
-			return "assets/images/placeholder.png"
+			return image_variants_for(IMAGE_PLACEHOLDER)
 
 
 
@@ -23,13 +23,17 @@ load_dotenv(find_dotenv())
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_COLOR_SEQUENCE = ['#FD486D', '#9F4A86', '#F5D107', '#86D7DC', '#333D79', '#E5732D', '#4CAF8E', '#722B5C', '#FFC10A', '#005580']
+# (trace index, color property) for each palette slot used by render_summary_charts
+SUMMARY_CHART_COLOR_SLOTS = [(0, 'marker'), (1, 'marker'), (2, 'line'), (3, 'line')]
+
 class UInterface:
 	def __init__(self):
 		logger.info('Initializing Dashboard UI')
 		self.init_time = datetime.now()
 		self.product_name = 'BI Demo | Dashboard | Nick Earl'
 		self.styles = {
-			'color_sequence': ['#FD486D', '#9F4A86', '#F5D107', '#86D7DC', '#333D79', '#E5732D', '#4CAF8E', '#722B5C', '#FFC10A', '#005580'],
+			'color_sequence': list(DEFAULT_COLOR_SEQUENCE),
 			'portrait_colors': ['#86D7DC', '#9B004E','#FA005A','#FFC500','#520044'],
 			'comp_colors':['#54898d','#9F4A86'],
 			'category_color_map': {},
@@ -989,6 +993,18 @@ class UInterface:
 		else:
 			return chart
 
+	@staticmethod
+	def recolor_summary_chart(colors=None):
+		"""
+		Patch for an already-rendered summary chart figure that swaps in a new palette, without reloading
+		or re-aggregating data. Keep SUMMARY_CHART_COLOR_SLOTS in step with the traces in render_summary_charts.
+		"""
+		colors = colors or DEFAULT_COLOR_SEQUENCE
+		patch = Patch()
+		for (trace, prop), color in zip(SUMMARY_CHART_COLOR_SLOTS, colors):
+			patch['data'][trace][prop]['color'] = color
+		return patch
+
 	def auto_num_format(self,raw_number):
 		num = float(f'{raw_number:.3g}')
 		magnitude = 0
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import os, json, random, re, base64, io, uuid, time, socket, calendar, logging
+import os, json, random, re, io, time, socket, calendar, logging
 import pathlib
 from dotenv import load_dotenv, find_dotenv
 import dash
@@ -14,10 +14,14 @@ import plotly.express as px
 import pandas as pd
 import numpy as np
 from datetime import date, datetime
-from google import genai
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from google.genai import types
 from conf import GlobalUInterface
 from dash_app.utils import load_secret
+from dash_app.genai_client import get_genai_client, call_model, stream_model
+from dash_app.image_store import store_image_variants
+from dash_app.background_jobs import JobCancelled
 try:
 	import google.auth
 	from googleapiclient.discovery import build
@@ -31,10 +35,60 @@ except ImportError:
 load_dotenv(find_dotenv())
 PAGE = 'sales_enablement'
 REDIS_URL = os.environ['REDIS_URL']
+# Slide images render concurrently; each one gets SLIDE_IMAGE_TIMEOUT seconds before it is dropped
+SLIDE_IMAGE_WORKERS = int(os.getenv('SLIDE_IMAGE_WORKERS', '5'))
+SLIDE_IMAGE_TIMEOUT = int(os.getenv('SLIDE_IMAGE_TIMEOUT', '90'))
+# Shared by the deck panel and its progress panel; sales_generate_deck shows one at a time
+PITCH_PANEL_STYLE = {'padding': '2rem', 'background-color': '#f8f9fa', 'border-radius': '0.5rem', 'min-height': '400px'}
 pd.set_option('future.no_silent_downcasting', True)
 
 logger = logging.getLogger(__name__)
 
+def _stream_json_array_items(chunks, key):
+	"""
+	Incrementally parses streamed JSON text and yields each object in the top-level `key` array as
+	soon as its closing brace arrives, instead of waiting for the whole document.
+	Falls back to parsing the complete text if no array items were found while streaming.
+	"""
+	buf = ''
+	pos = None
+	depth, start, in_str, escaped = 0, None, False, False
+	emitted = 0
+	for chunk in chunks:
+		buf += chunk
+		if pos is None:
+			m = re.search(r'"%s"\s*:\s*\[' % re.escape(key), buf)
+			if not m:
+				continue
+			pos = m.end()
+		i = pos
+		while i < len(buf):
+			c = buf[i]
+			if in_str:
+				if escaped:
+					escaped = False
+				elif c == '\\':
+					escaped = True
+				elif c == '"':
+					in_str = False
+			elif c == '"':
+				in_str = True
+			elif c == '{':
+				if depth == 0:
+					start = i
+				depth += 1
+			elif c == '}':
+				depth -= 1
+				if depth == 0:
+					emitted += 1
+					yield json.loads(buf[start:i+1])
+			elif c == ']' and depth == 0:
+				return
+			i += 1
+		pos = i
+	if not emitted:
+		yield from json.loads(buf).get(key, [])
+
 class UInterface:
 	def __init__(self):
 		self.global_ui = GlobalUInterface()
@@ -141,6 +195,13 @@ class UInterface:
 			centered=True,
 		)
 
+		self.layout['slide_modal'] = dbc.Modal(
+			dbc.ModalBody(html.Img(id='sales-slide-modal-img', style={'width': '100%'})),
+			id='sales-slide-modal',
+			size='xl',
+			centered=True,
+		)
+
 		self.layout['pitch_generator'] = dbc.Container([
 			dbc.Card([
 				dbc.CardHeader([
@@ -165,29 +226,28 @@ class UInterface:
 							], gap=2),
 						], width=4, style={'border-right': '1px solid #eee'}),
 						dbc.Col([
-							dcc.Loading(
-								id='sales-pitch-loading',
-								children=[
-									html.Div(
-										[self.example_carousel, self.default_plaque],
-										id='sales-pitch-output',
-										style={'padding': '2rem', 'background-color': '#f8f9fa', 'border-radius': '0.5rem', 'min-height': '400px'}
-									),
-									dcc.Download(id='sales-download-deck'),
-								],
-								custom_spinner=html.Div([
-									html.Div(className="ai-spinner"),
-									html.Div("Generating Pitch Deck...", className="loading-text"),
-									html.Div("Gemini is analyzing data and rendering slides.", className="text-muted small")
-								], className="d-flex flex-column align-items-center justify-content-center p-5 bg-white shadow rounded"),
-								overlay_style={"visibility":"visible", "filter": "blur(4px)", "opacity": "0.8", "background-color": "white"},
-							)
+							# No dcc.Loading overlay here: sales_generate_deck streams slides into the progress
+							# panel as they render, then puts the finished deck in the output panel
+							html.Div(id='sales-pitch-progress', style={**PITCH_PANEL_STYLE, 'display': 'none'}),
+							html.Div(
+								[self.example_carousel, self.default_plaque],
+								id='sales-pitch-output',
+								style=PITCH_PANEL_STYLE
+							),
+							dcc.Download(id='sales-download-deck'),
 						], width=8),
 					]),
 				]),
 			]),
 		])
 
+	def deck_status(self, message="Gemini is analyzing data and rendering slides."):
+		return html.Div([
+			html.Div(className="ai-spinner"),
+			html.Div("Generating Pitch Deck...", className="loading-text"),
+			html.Div(message, className="text-muted small")
+		], className="d-flex flex-column align-items-center justify-content-center p-5 bg-white shadow rounded")
+
 	def _create_plaque(self, company, industry, audience, style, length):
 		return html.Div([
 			html.H6("Generation Parameters", className="text-uppercase text-muted mb-3", style={'letter-spacing': '1px'}),
@@ -200,7 +260,11 @@ class UInterface:
 			], gap=3)
 		], className="mt-4 p-4 rounded shadow-sm", style={'background-color': '#e9ecef', 'border-left': '5px solid #6c757d'})
 
-	def ai_generate_deck(self, company, industry, audience, style, length):
+	def ai_generate_deck(self, company, industry, audience, style, length, on_progress=None):
+		"""
+		Plans and renders the deck. If `on_progress` is given it is called with the partial deck
+		component each time a slide image finishes, so callers can stream slides to the page.
+		"""
 		logger.info(f'Generating sales deck for {company}')
 		api_key = load_secret("GEMINI_API_KEY")
 		if api_key:
@@ -210,7 +274,7 @@ class UInterface:
 			logger.error("GEMINI_API_KEY is None or empty.")
 			return {'error': "Error: API Key missing."}
 
-		client = genai.Client(api_key=api_key)
+		client = get_genai_client(api_key)
 		
 		prompt = f"""
 		You are a senior sales executive for UHF+, a fast-growing Free Ad-Supported TV (FAST) streaming service.
@@ -241,7 +305,8 @@ class UInterface:
 		"""
 		
 		try:
-			response = client.models.generate_content(
+			# Stream the plan so each slide's image job starts as soon as that slide is planned
+			stream = stream_model(lambda: client.models.generate_content_stream(
 				model="gemini-3-flash-preview",
 				contents=[
 					types.Content(
@@ -252,37 +317,24 @@ class UInterface:
 				config=types.GenerateContentConfig(
 					response_mime_type="application/json",
 				)
-			)
+			), name='deck-plan')
 			
-			deck_data = json.loads(response.text)
-			slides = deck_data.get('slides', [])[:5] # Enforce max 5 slides
+			slides = islice(_stream_json_array_items((chunk.text or '' for chunk in stream), 'slides'), 5) # Enforce max 5 slides
 			
+			plaque = self._create_plaque(company, industry, audience, style, length)
+			on_slide = None
+			if on_progress:
+				on_slide = lambda slides, images, pending: on_progress(self._deck_component(slides, images, plaque, pending, streaming=True))
+
 			# Generate Images
-			carousel_items = []
-			for i, slide in enumerate(slides):
-				logger.info(f"Generating image for slide {i+1}/{len(slides)}")
-				img_src = self._generate_slide_image(client, slide['image_prompt'])
-				if img_src:
-					carousel_items.append({
-						"key": f"{i}",
-						"src": img_src,
-						"img_style": {"height": "500px", "width": "100%", "object-fit": "contain"}
-					})
-			
-			if not carousel_items:
+			slides, images = self._generate_slide_images(client, slides, on_slide=on_slide)
+			if not any(images):
 				return {'error': "Failed to generate slide images."}
 
-			carousel = dbc.Carousel(
-				items=carousel_items,
-				controls=True,
-				indicators=True,
-				variant="dark"
-			)
-			
-			plaque = self._create_plaque(company, industry, audience, style, length)
-			
-			return {'component': html.Div([carousel, plaque])}
+			return {'component': self._deck_component(slides, images, plaque)}
 
+		except JobCancelled:
+			raise
 		except Exception as e:
 			logger.error(f"Error generating pitch: {e}")
 			return {'error': f"Sorry, I couldn't generate a pitch at this time. Error: {str(e)}"}
@@ -294,41 +346,105 @@ class UInterface:
 		except:
 			return (0, 0, 0)
 
+	def _deck_component(self, slides, images, plaque, pending=(), streaming=False):
+		# While slides are still rendering the carousel shows thumbnails, which arrive fastest; the
+		# finished deck swaps in display-sized variants
+		items = [self._carousel_item(i, slide, image, i in pending, 'thumb' if streaming else 'display') for i, (slide, image) in enumerate(zip(slides, images))]
+		if streaming:
+			# Rendered in the progress panel while the previous deck, ids included, is still mounted
+			# (hidden) in the output panel, so the preview carries no ids
+			return html.Div([dbc.Carousel(items=items, controls=True, indicators=True, variant="dark"), plaque])
+		carousel = dbc.Carousel(
+			id='sales-deck-carousel',
+			items=items,
+			controls=True,
+			indicators=True,
+			variant="dark"
+		)
+		# The originals are only fetched when the modal opens
+		expand = dbc.Button([html.I(className='bi bi-arrows-fullscreen'), " View full resolution"], id='sales-deck-expand', color='link', size='sm')
+		full_images = dcc.Store(id='sales-deck-images', data=[image['full'] if image else None for image in images])
+		return html.Div([carousel, html.Div(expand, className='text-end'), full_images, plaque])
+
+	def _carousel_item(self, i, slide, image, pending=False, size='display'):
+		item = {
+			"key": f"{i}",
+			"src": image[size] if image else None,
+			"img_style": {"height": "500px", "width": "100%", "object-fit": "contain"}
+		}
+		if pending:
+			item['src'] = 'assets/images/placeholder.png'
+			item['header'] = slide.get('title', f'Slide {i+1}')
+			item['caption'] = "Rendering..."
+		elif not image:
+			# Failed slides keep their place in the deck instead of silently disappearing
+			item['src'] = 'assets/images/placeholder.png'
+			item['header'] = slide.get('title', f'Slide {i+1}')
+			item['caption'] = "This slide couldn't be rendered."
+		return item
+
+	def _generate_slide_images(self, client, slides, on_slide=None):
+		"""
+		Renders slide images concurrently. `slides` may be a list or an iterator that yields slides
+		while the plan is still streaming; each image job is submitted as soon as its slide arrives.
+		Returns (slides, images) with one image_store variants dict per slide, in slide order, and None
+		for slides that failed or ran past SLIDE_IMAGE_TIMEOUT.
+		`on_slide(slides, images, pending)` is called whenever a slide is planned or finishes rendering,
+		with the indices still rendering.
+		"""
+		pool = ThreadPoolExecutor(max_workers=SLIDE_IMAGE_WORKERS, thread_name_prefix='slide-image')
+		planned, images, futures = [], [], {}
+		not_done = set()
+
+		def collect(timeout):
+			nonlocal not_done
+			done, not_done = wait(not_done, timeout=timeout, return_when=FIRST_COMPLETED)
+			for future in done:
+				images[futures[future]] = future.result()
+			return done
+
+		def report():
+			if on_slide:
+				on_slide(list(planned), list(images), {futures[f] for f in not_done})
+
+		try:
+			for slide in slides:
+				future = pool.submit(self._generate_slide_image, client, slide['image_prompt'])
+				futures[future] = len(planned)
+				planned.append(slide)
+				images.append(None)
+				not_done.add(future)
+				collect(0)
+				report()
+			deadline = time.monotonic() + SLIDE_IMAGE_TIMEOUT
+			while not_done:
+				if not collect(max(0, deadline - time.monotonic())):
+					logger.warning(f"{len(not_done)}/{len(planned)} slide images timed out after {SLIDE_IMAGE_TIMEOUT}s")
+					break
+				report()
+			return planned, images
+		finally:
+			# Don't hold the callback open for stragglers that already missed the deadline
+			pool.shutdown(wait=False, cancel_futures=True)
+
 	def _generate_slide_image(self, client, image_prompt):
 		try:
-			response = client.models.generate_content(
+			response = call_model(lambda: client.models.generate_content(
 				model="gemini-3-pro-image-preview",
 				contents=[types.Content(role="user", parts=[types.Part.from_text(text=image_prompt)])],
 				config=types.GenerateContentConfig(
 					image_config=types.ImageConfig(image_size="1K"),
 					response_modalities=["IMAGE"],
 				)
-			)
+			), name='slide-image', deadline=SLIDE_IMAGE_TIMEOUT)
 			if response.parts:
 				for part in response.parts:
 					if part.inline_data and part.inline_data.data:
-						b64_data = base64.b64encode(part.inline_data.data).decode('utf-8')
-						mime_type = part.inline_data.mime_type or "image/png"
-						return f"data:{mime_type};base64,{b64_data}"
+						return store_image_variants(part.inline_data.data, part.inline_data.mime_type)
 		except Exception as e:
 			logger.error(f"Error generating slide image: {e}")
 		return None
 
-	def _upload_to_gcs(self, image_stream):
-		bucket_name = os.environ.get('GCS_BUCKET_NAME')
-		if not bucket_name or not storage:
-			logger.warning("GCS_BUCKET_NAME not set or storage lib missing. Skipping image upload.")
-			return None
-		try:
-			client = storage.Client()
-			bucket = client.bucket(bucket_name)
-			blob = bucket.blob(f"slide_assets/{uuid.uuid4()}.png")
-			blob.upload_from_file(image_stream, content_type='image/png')
-			return blob.public_url
-		except Exception as e:
-			logger.error(f"GCS Upload failed: {e}")
-			return None
-
 	def show_alert(self, text, color='warning'):
 		icon = None
 		dismissable = True
@@ -362,6 +478,7 @@ def create_app_layout(ui):
 				html.Hr(),
 				ui.layout['pitch_generator'],
 				ui.layout['onboarding_modal'],
+				ui.layout['slide_modal'],
 			],className='d-flex flex-column justify-content-center align-items-center'),
 		]),
 		dcc.Interval(id='interval-10-sec',interval=10*1000,n_intervals=0),
@@ -0,0 +1,179 @@
+import os
+import re
+import math
+import logging
+
+"""
+Local palette index
+
+Answers color-palette prompts from the curated palettes in conf.GlobalUInterface.colors without a
+model call. A prompt is scored against each palette by:
+	- keyword/tag matching: hand-picked tags ("ocean" -> blue_green_coast) and the full palette name
+	  as a phrase ("blue green coast"). Single words of a name are not tags, since names are made
+	  of generic words ("deep", "sea", "blue") that would match unrelated prompts outright
+	- perceptual search: color names and hex codes in the prompt are converted to CIELAB and
+	  compared to each palette's colors, so "teal and navy" lands near the palette that actually
+	  contains those shades. Color words only ever match perceptually; a shade modifier in front of
+	  one ("dark green", "pale blue") shifts its lightness and chroma before comparing
+The score is the share of the prompt's meaningful words a palette accounts for; other modifiers
+count against palettes not tagged with them. Only matches at or above PALETTE_MATCH_THRESHOLD are
+returned; anything less confident should go to the LLM.
+
+Settings (env):
+	PALETTE_MATCH_THRESHOLD      minimum confidence for a local answer, 0-1 (default 0.75)
+	PALETTE_PERCEPTUAL_RADIUS    CIELAB distance at which a color stops counting as a match (default 40)
+"""
+
+logger = logging.getLogger(__name__)
+
+PALETTE_MATCH_THRESHOLD = float(os.getenv('PALETTE_MATCH_THRESHOLD', '0.75'))
+PALETTE_PERCEPTUAL_RADIUS = float(os.getenv('PALETTE_PERCEPTUAL_RADIUS', '40'))
+PALETTE_SIZE = 12
+
+# Palettes in conf.py that are UI utility colors rather than themes
+EXCLUDED_PALETTES = {'comp_colors', 'brand', 'success', 'background', 'sequence'}
+
+PALETTE_TAGS = {
+	'balanced_spectrum': ['rainbow', 'spectrum', 'pride', 'colorful', 'multicolor', 'multicolored', 'balanced'],
+	'blue_green_coast': ['ocean', 'sea', 'beach', 'coast', 'coastal', 'tropical', 'lagoon', 'aqua', 'water', 'caribbean', 'surf'],
+	'cool_night': ['night', 'midnight', 'twilight', 'galaxy', 'space', 'moonlight', 'moon', 'cosmic', 'starry'],
+	'desert_dusk': ['desert', 'dusk', 'sand', 'sandy', 'canyon', 'southwest', 'sahara', 'dune', 'dunes'],
+	'earth_and_clay': ['earth', 'earthy', 'clay', 'terracotta', 'pottery', 'rustic', 'soil', 'adobe'],
+	'forest_and_moss': ['forest', 'moss', 'woods', 'woodland', 'jungle', 'nature', 'leaves', 'pine', 'evergreen', 'garden'],
+	'jewel_tones': ['jewel', 'jewels', 'gem', 'gems', 'gemstone', 'gemstones', 'emerald', 'sapphire', 'ruby', 'amethyst', 'royal', 'luxury'],
+	'nord_breeze': ['nord', 'nordic', 'scandinavian', 'arctic', 'frost', 'frosty', 'winter', 'ice', 'icy', 'breeze', 'glacier'],
+	'soft_pastels': ['pastel', 'pastels', 'soft', 'spring', 'baby', 'candy', 'easter', 'gentle', 'nursery'],
+	'stone_and_steel': ['stone', 'steel', 'industrial', 'metal', 'metallic', 'concrete', 'slate', 'urban', 'corporate'],
+	'vibrant_but_tame': ['vibrant', 'lively', 'playful', 'cheerful', 'energetic'],
+	'warm_sunset': ['sunset', 'sunrise', 'warm', 'autumn', 'fall', 'fire', 'golden', 'summer', 'tropical sunset'],
+	'neon_noir_20': ['neon', 'noir', 'cyberpunk', 'synthwave', 'vaporwave', 'outrun', '80s', 'retro', 'nightclub', 'arcade'],
+	'solar_ice_20': ['solar', 'fire and ice', 'hot and cold'],
+	'colorblind_safe_20': ['colorblind', 'color blind', 'accessible', 'accessibility', 'cvd'],
+	'pastel_distinct_20': ['pastel distinct'],
+	'deep_tones_20': ['deep', 'dark', 'rich', 'moody'],
+	'bright_ink_20': ['ink', 'bright', 'bold', 'comic', 'pop art'],
+	'earth_sea_20': ['earth and sea', 'land and sea'],
+	'cool_warm_20': ['cool and warm', 'diverging', 'heatmap'],
+	'darkmode_distinct_20': ['dark mode', 'darkmode', 'dark theme'],
+	'muted_modern_20': ['muted', 'modern', 'minimal', 'minimalist', 'subdued', 'understated'],
+	'mono_plus_accents_20': ['monochrome', 'monochromatic', 'mono', 'grayscale', 'greyscale', 'accent', 'accents'],
+	'distinct_primary_20': ['primary', 'primaries', 'distinct', 'categorical'],
+}
+
+NAMED_COLORS = {
+	'red': '#E53935', 'crimson': '#DC143C', 'maroon': '#800000', 'burgundy': '#800020', 'orange': '#FB8C00',
+	'coral': '#FF7F50', 'peach': '#FFCBA4', 'yellow': '#FDD835', 'gold': '#FFD700', 'mustard': '#E1AD01',
+	'olive': '#808000', 'lime': '#9CCC65', 'green': '#43A047', 'mint': '#98FF98', 'sage': '#9CAF88',
+	'teal': '#008080', 'turquoise': '#40E0D0', 'cyan': '#00BCD4', 'blue': '#1E88E5', 'navy': '#000080',
+	'cobalt': '#0047AB', 'indigo': '#3F51B5', 'violet': '#8F00FF', 'purple': '#8E24AA', 'lavender': '#B57EDC',
+	'lilac': '#C8A2C8', 'magenta': '#FF00FF', 'pink': '#EC407A', 'rose': '#FF66CC', 'brown': '#795548',
+	'tan': '#D2B48C', 'beige': '#D8C8A8', 'gray': '#9E9E9E', 'grey': '#9E9E9E', 'charcoal': '#36454F',
+	'black': '#212121', 'silver': '#C0C0C0',
+}
+
+STOPWORDS = {
+	'a', 'an', 'and', 'the', 'of', 'with', 'in', 'on', 'for', 'to', 'like', 'style', 'styled', 'theme',
+	'themed', 'palette', 'palettes', 'colors', 'colours', 'color', 'colour', 'scheme', 'tones', 'tone',
+	'shades', 'shade', 'vibe', 'vibes', 'inspired', 'by', 'please', 'some', 'me', 'give', 'make', 'i',
+	'want',
+}
+# Shade modifier -> (CIELAB lightness shift, chroma factor) applied to the color word that follows it
+MODIFIERS = {
+	'light': (20, 1.0), 'pale': (25, 0.6), 'soft': (15, 0.7),
+	'dark': (-20, 1.0), 'deep': (-20, 1.1), 'bright': (5, 1.25),
+}
+
+def _hex_to_lab(hex_color: str) -> tuple[float, float, float]:
+	"""sRGB hex -> CIELAB (D65)."""
+	hex_color = hex_color.lstrip('#')
+	rgb = [int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4)]
+	r, g, b = [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in rgb]
+	x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+	y = (0.2126 * r + 0.7152 * g + 0.0722 * b) / 1.00000
+	z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+	fx, fy, fz = [t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116 for t in (x, y, z)]
+	return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+def _shade(lab: tuple[float, float, float], modifier: str) -> tuple[float, float, float]:
+	shift, chroma = MODIFIERS[modifier]
+	return (min(100.0, max(0.0, lab[0] + shift)), lab[1] * chroma, lab[2] * chroma)
+
+class PaletteIndex:
+	def __init__(self, palettes: dict[str, list[str]], threshold: float = PALETTE_MATCH_THRESHOLD, radius: float = PALETTE_PERCEPTUAL_RADIUS):
+		self.threshold = threshold
+		self.radius = radius
+		self.palettes = {
+			name: colors for name, colors in palettes.items()
+			if name not in EXCLUDED_PALETTES and len(colors) >= PALETTE_SIZE
+		}
+		self.labs = {name: [_hex_to_lab(c) for c in colors] for name, colors in self.palettes.items()}
+		self.tags = {}
+		for name in self.palettes:
+			self.tags[name] = {re.sub(r'_\d+$', '', name).replace('_', ' ')} | set(PALETTE_TAGS.get(name, []))
+		logger.debug(f'Built palette index over {len(self.palettes)} palettes')
+
+	def _parse(self, prompt: str) -> tuple[list[str], list[str], dict[str, tuple]]:
+		text = (prompt or '').lower()
+		hexes = re.findall(r'#(?:[0-9a-f]{6})\b', text)
+		words = re.findall(r"[a-z0-9']+", re.sub(r'#[0-9a-f]{6}\b', ' ', text))
+		colors = {h: _hex_to_lab(h) for h in hexes}
+		content = []
+		i = 0
+		while i < len(words):
+			w = words[i]
+			following = words[i + 1] if i + 1 < len(words) else None
+			if w in MODIFIERS and following in NAMED_COLORS:
+				# "dark green" is one color, not a modifier plus a color
+				colors[f'{w} {following}'] = _shade(_hex_to_lab(NAMED_COLORS[following]), w)
+				content.append(f'{w} {following}')
+				i += 2
+				continue
+			if w in NAMED_COLORS:
+				colors[w] = _hex_to_lab(NAMED_COLORS[w])
+			if w not in STOPWORDS or w in NAMED_COLORS:
+				content.append(w)
+			i += 1
+		content += hexes
+		phrases = [' '.join(words[i:i+n]) for n in (2, 3) for i in range(len(words) - n + 1)]
+		return content, phrases, colors
+
+	def _closeness(self, lab, name) -> float:
+		nearest = min(math.dist(lab, p) for p in self.labs[name])
+		return max(0.0, 1 - nearest / self.radius)
+
+	def score(self, prompt: str) -> list[tuple[float, str]]:
+		"""(confidence, palette name) for every palette, best first."""
+		content, phrases, colors = self._parse(prompt)
+		if not content:
+			return []
+		scores = []
+		for name, tags in self.tags.items():
+			# A multi-word tag ("fire and ice", "blue green coast") accounts for every word it spans
+			covered = {w for phrase in phrases if phrase in tags for w in phrase.split()}
+			matched = 0.0
+			for token in content:
+				if token in covered:
+					matched += 1
+				elif token in colors:
+					matched += self._closeness(colors[token], name)
+				elif token in tags:
+					matched += 1
+			scores.append((matched / len(content), name))
+		return sorted(scores, reverse=True)
+
+	def match(self, prompt: str) -> dict | None:
+		"""
+		Returns {'palette', 'colors', 'confidence'} for the best palette if it clears the threshold,
+		else None. Colors are the palette's first PALETTE_SIZE entries, or, when the prompt names
+		colors, the PALETTE_SIZE entries closest to them.
+		"""
+		scores = self.score(prompt)
+		if not scores or scores[0][0] < self.threshold:
+			return None
+		confidence, name = scores[0]
+		_, _, colors = self._parse(prompt)
+		palette = self.palettes[name]
+		if colors:
+			order = sorted(range(len(palette)), key=lambda i: min(math.dist(self.labs[name][i], lab) for lab in colors.values()))
+			palette = [palette[i] for i in order]
+		return {'palette': name, 'colors': list(palette[:PALETTE_SIZE]), 'confidence': round(confidence, 3)}
@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import redis
+from redis_pool import get_redis_client
+
+"""
+Prompt-keyed response cache for AI calls
+
+Many users send the same prompts ("sunset", "ocean", "cyberpunk"), so model responses are cached in
+Redis keyed by (namespace, model, normalized prompt). Entries expire after `ttl` seconds, and a
+sorted-set index keeps the newest `max_entries` per namespace (least recently used are evicted).
+Hit/miss counters are kept in Redis so the ratio covers every web and Celery worker.
+
+The cache is best-effort: any Redis error is logged and treated as a miss.
+
+Settings (env):
+	PROMPT_CACHE_TTL             seconds an entry lives (default 604800, 7 days)
+	PROMPT_CACHE_MAX_ENTRIES     entries kept per namespace (default 5000)
+"""
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_TTL = int(os.getenv('PROMPT_CACHE_TTL', str(7 * 24 * 3600)))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', '5000'))
+
+_registry: dict[str, 'PromptCache'] = {}
+
+def normalize_prompt(prompt: str) -> str:
+	"""Case, surrounding punctuation and whitespace runs don't change the answer, so they don't change the key."""
+	prompt = re.sub(r'\s+', ' ', (prompt or '').lower()).strip()
+	return prompt.strip(' .,!?;:"\'')
+
+class PromptCache:
+	def __init__(self, namespace: str, ttl: int = PROMPT_CACHE_TTL, max_entries: int = PROMPT_CACHE_MAX_ENTRIES, redis_client: redis.Redis | None = None):
+		self.namespace = namespace
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.redis = redis_client or get_redis_client()
+		self.prefix = f'prompt-cache:{namespace}'
+		self.index_key = f'{self.prefix}:index'
+		self.stats_key = f'{self.prefix}:stats'
+		_registry[namespace] = self
+
+	def _digest(self, prompt: str, model: str) -> str:
+		return hashlib.sha256(f'{model}\n{normalize_prompt(prompt)}'.encode()).hexdigest()
+
+	def get(self, prompt: str, model: str):
+		"""Returns the cached response, or None on a miss."""
+		digest = self._digest(prompt, model)
+		try:
+			raw = self.redis.get(f'{self.prefix}:{digest}')
+			pipe = self.redis.pipeline(transaction=False)
+			if raw is not None:
+				pipe.zadd(self.index_key, {digest: time.time()})
+			pipe.hincrby(self.stats_key, 'hits' if raw is not None else 'misses', 1)
+			pipe.execute()
+		except redis.RedisError as e:
+			logger.warning(f'Prompt cache read failed ({self.namespace}): {e}')
+			return None
+		if raw is None:
+			return None
+		logger.debug(f'Prompt cache hit ({self.namespace}): {normalize_prompt(prompt)!r}')
+		return json.loads(raw)
+
+	def set(self, prompt: str, model: str, value) -> None:
+		digest = self._digest(prompt, model)
+		try:
+			pipe = self.redis.pipeline(transaction=False)
+			pipe.set(f'{self.prefix}:{digest}', json.dumps(value), ex=self.ttl)
+			pipe.zadd(self.index_key, {digest: time.time()})
+			# Index members older than the TTL point at keys Redis already expired
+			pipe.zremrangebyscore(self.index_key, '-inf', time.time() - self.ttl)
+			pipe.zcard(self.index_key)
+			size = pipe.execute()[-1]
+			if size > self.max_entries:
+				evicted = self.redis.zpopmin(self.index_key, size - self.max_entries)
+				if evicted:
+					self.redis.delete(*[f'{self.prefix}:{member.decode() if isinstance(member, bytes) else member}' for member, _ in evicted])
+		except redis.RedisError as e:
+			logger.warning(f'Prompt cache write failed ({self.namespace}): {e}')
+
+	def stats(self) -> dict:
+		try:
+			counts = self.redis.hgetall(self.stats_key)
+			entries = self.redis.zcard(self.index_key)
+		except redis.RedisError as e:
+			return {'namespace': self.namespace, 'error': str(e)}
+		hits = int(counts.get(b'hits', counts.get('hits', 0)))
+		misses = int(counts.get(b'misses', counts.get('misses', 0)))
+		return {
+			'namespace': self.namespace,
+			'hits': hits,
+			'misses': misses,
+			'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+			'entries': entries,
+			'max_entries': self.max_entries,
+			'ttl': self.ttl,
+		}
+
+def cache_stats() -> list[dict]:
+	"""Stats for every prompt cache created in this process."""
+	return [cache.stats() for cache in list(_registry.values())]
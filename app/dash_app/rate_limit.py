@@ -0,0 +1,241 @@
+import os
+import time
+import math
+import logging
+import redis
+from redis_pool import get_redis_client
+
+"""
+Per-session admission control and fair-share dispatch for background AI jobs
+
+Each Celery pool has a few worker slots, so one session clicking Submit repeatedly could starve
+everyone else. Jobs are checked in the web process before anything is queued, so a rejected request
+gets its callback's `on_limit` response right away instead of after waiting in the queue:
+	- a token from the session's Redis token bucket (AI_RATE_LIMIT_BURST, refilled at
+	  AI_RATE_LIMIT_PER_MINUTE), and
+	- a job slot: fewer than AI_MAX_JOBS_PER_SESSION of the session's jobs admitted and not finished
+Admitted jobs then go through a FairQueue per pool: they're sent to Celery only while the pool has
+a free worker, and otherwise wait in per-session lists that are drained round-robin, so a session
+with several jobs waiting can't get ahead of one with a single job. Past AI_MAX_QUEUED_JOBS waiting
+jobs, new ones are turned away with a "try later" response. Checks fail open if Redis is unavailable.
+
+Slots and pool capacity are given back when the job finishes or is revoked (see
+task_queues.release_job), or after AI_JOB_SLOT_TTL if that never happens. Waiting jobs are kept for
+the FairQueue's `held_ttl` instead, which task_queues sets to how long Dash keeps polling for them.
+
+Settings (env):
+	AI_RATE_LIMIT_BURST          tokens a session can spend at once (default 3)
+	AI_RATE_LIMIT_PER_MINUTE     token refill rate per session (default 6)
+	AI_MAX_JOBS_PER_SESSION      concurrent AI jobs per session (default 1)
+	AI_MAX_QUEUED_JOBS           jobs waiting for a worker, per pool, before new ones are rejected (default 20)
+	AI_JOB_SLOT_TTL              seconds before a crashed job's slot is reclaimed (default 300)
+"""
+
+logger = logging.getLogger(__name__)
+
+AI_RATE_LIMIT_BURST = int(os.getenv('AI_RATE_LIMIT_BURST', '3'))
+AI_RATE_LIMIT_PER_MINUTE = float(os.getenv('AI_RATE_LIMIT_PER_MINUTE', '6'))
+AI_MAX_JOBS_PER_SESSION = int(os.getenv('AI_MAX_JOBS_PER_SESSION', '1'))
+AI_MAX_QUEUED_JOBS = int(os.getenv('AI_MAX_QUEUED_JOBS', '20'))
+AI_JOB_SLOT_TTL = int(os.getenv('AI_JOB_SLOT_TTL', '300'))
+
+# Refill, then try to take one token. Returns {allowed, seconds until a token is available}
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+	tokens = tokens - 1
+	allowed = 1
+else
+	retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+# Take a job slot if the session is under its limit. Returns 1 if taken
+_ACQUIRE_SLOT_SCRIPT = """
+local running = tonumber(redis.call('GET', KEYS[1]) or '0')
+if running >= tonumber(ARGV[1]) then
+	return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+return 1
+"""
+
+# Sends held jobs round-robin across sessions while the pool has free workers. Returns their payloads
+_PUMP = """
+local function pump(prefix, running, held, ring, members, now, ttl, capacity)
+	local out = {}
+	while redis.call('ZCARD', running) < capacity do
+		local session = redis.call('LPOP', ring)
+		if not session then
+			break
+		end
+		local pending = prefix .. ':pending:' .. session
+		local job = redis.call('LPOP', pending)
+		if redis.call('LLEN', pending) > 0 then
+			redis.call('RPUSH', ring, session)
+		else
+			redis.call('SREM', members, session)
+		end
+		if job then
+			local payload = redis.call('GET', prefix .. ':job:' .. job)
+			redis.call('DEL', prefix .. ':job:' .. job)
+			redis.call('ZREM', held, job)
+			if payload then
+				redis.call('ZADD', running, now + ttl, job)
+				table.insert(out, payload)
+			end
+		end
+	end
+	return out
+end
+"""
+
+# Queues a job behind its session's others, then pumps. Returns false if too many jobs are waiting
+_SUBMIT_SCRIPT = _PUMP + """
+local running, held, ring, members = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local job, session, payload, prefix = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local now, ttl, capacity, max_held = tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])
+local held_ttl = tonumber(ARGV[9])
+redis.call('ZREMRANGEBYSCORE', running, '-inf', now)
+redis.call('ZREMRANGEBYSCORE', held, '-inf', now)
+if redis.call('ZCARD', held) >= max_held and redis.call('ZCARD', running) >= capacity then
+	return false
+end
+redis.call('SET', prefix .. ':job:' .. job, payload, 'EX', held_ttl)
+redis.call('ZADD', held, now + held_ttl, job)
+local pending = prefix .. ':pending:' .. session
+redis.call('RPUSH', pending, job)
+redis.call('EXPIRE', pending, held_ttl)
+if redis.call('SADD', members, session) == 1 then
+	redis.call('RPUSH', ring, session)
+end
+return pump(prefix, running, held, ring, members, now, ttl, capacity)
+"""
+
+# Frees a running job's worker (or drops a waiting one), then pumps
+_FINISH_SCRIPT = _PUMP + """
+local running, held, ring, members = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local job, prefix = ARGV[1], ARGV[2]
+local now, ttl, capacity = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+redis.call('ZREM', running, job)
+redis.call('ZREM', held, job)
+redis.call('DEL', prefix .. ':job:' .. job)
+redis.call('ZREMRANGEBYSCORE', running, '-inf', now)
+redis.call('ZREMRANGEBYSCORE', held, '-inf', now)
+return pump(prefix, running, held, ring, members, now, ttl, capacity)
+"""
+
+class RateLimited(Exception):
+	def __init__(self, message: str, retry_after: float | None = None):
+		super().__init__(message)
+		self.retry_after = retry_after
+
+class _Limiter:
+	def __init__(self, redis_client: redis.Redis | None = None):
+		self.redis = redis_client or get_redis_client()
+		self._take_token = self.redis.register_script(_TOKEN_BUCKET_SCRIPT)
+		self._acquire_slot = self.redis.register_script(_ACQUIRE_SLOT_SCRIPT)
+
+	def admit(self, session_id: str, scope: str) -> str | None:
+		"""Returns the slot key to release when the job ends, or None if nothing was acquired. Raises RateLimited."""
+		slot_key = f'ai-jobs:{scope}:{session_id}'
+		try:
+			if not self._acquire_slot(keys=[slot_key], args=[AI_MAX_JOBS_PER_SESSION, AI_JOB_SLOT_TTL]):
+				raise RateLimited('You already have a request running. It will finish shortly, try again after it does.')
+			allowed, retry_after = self._take_token(
+				keys=[f'rate-limit:{scope}:{session_id}'],
+				args=[AI_RATE_LIMIT_BURST, AI_RATE_LIMIT_PER_MINUTE / 60, time.time()],
+			)
+			if not allowed:
+				self.release(slot_key)
+				retry_after = math.ceil(float(retry_after))
+				raise RateLimited(f"You're sending requests faster than we can serve them. Try again in {retry_after}s.", retry_after)
+		except redis.RedisError as e:
+			logger.warning(f'Rate limiter unavailable, admitting job: {e}')
+			return None
+		return slot_key
+
+	def release(self, slot_key: str | None) -> None:
+		if not slot_key:
+			return
+		try:
+			if self.redis.decr(slot_key) <= 0:
+				self.redis.delete(slot_key)
+		except redis.RedisError as e:
+			logger.warning(f'Could not release AI job slot: {e}')
+
+_limiter: _Limiter | None = None
+
+def _get_limiter() -> _Limiter:
+	global _limiter
+	if _limiter is None:
+		_limiter = _Limiter()
+	return _limiter
+
+def admit(session_id: str, scope: str) -> str | None:
+	return _get_limiter().admit(session_id, scope)
+
+def release(slot_key: str | None) -> None:
+	_get_limiter().release(slot_key)
+
+class FairQueue:
+	"""
+	Round-robin dispatch across sessions for one worker pool of `capacity` slots. Running jobs hold
+	their slot for at most `job_ttl` seconds; waiting ones are dropped after `held_ttl` (default job_ttl).
+	"""
+
+	def __init__(self, name: str, capacity: int, redis_client: redis.Redis | None = None, job_ttl: int = AI_JOB_SLOT_TTL, held_ttl: int | None = None):
+		self.prefix = f'fair-queue:{name}'
+		self.capacity = capacity
+		self.job_ttl = job_ttl
+		self.held_ttl = held_ttl or job_ttl
+		self.redis = redis_client or get_redis_client()
+		self.keys = [f'{self.prefix}:{k}' for k in ('running', 'held', 'ring', 'members')]
+		self._submit = self.redis.register_script(_SUBMIT_SCRIPT)
+		self._finish = self.redis.register_script(_FINISH_SCRIPT)
+
+	def submit(self, job_id: str, session_id: str, payload: str) -> list[str]:
+		"""
+		Queues `payload` for job_id. Returns the payloads (possibly including this one) that now have a
+		worker and should be sent. Raises RateLimited if too many jobs are already waiting.
+		"""
+		try:
+			ready = self._submit(keys=self.keys, args=[job_id, session_id, payload, self.prefix, time.time(), self.job_ttl, self.capacity, AI_MAX_QUEUED_JOBS, self.held_ttl])
+		except redis.RedisError as e:
+			logger.warning(f'Fair queue unavailable, dispatching directly: {e}')
+			return [payload]
+		if ready is None:
+			raise RateLimited("Lots of people are generating right now. Try again in a minute.", 60)
+		return [p.decode() if isinstance(p, bytes) else p for p in ready]
+
+	def finish(self, job_id: str) -> list[str]:
+		"""Frees job_id's worker slot, or drops it if it was still waiting. Returns payloads to send next."""
+		try:
+			ready = self._finish(keys=self.keys, args=[job_id, self.prefix, time.time(), self.job_ttl, self.capacity])
+		except redis.RedisError as e:
+			logger.warning(f'Fair queue unavailable, could not finish job {job_id}: {e}')
+			return []
+		return [p.decode() if isinstance(p, bytes) else p for p in ready]
+
+def rate_limited(on_limit, scope: str = 'ai'):
+	"""
+	Marks a background callback for admission control, enforced by task_queues.QueuedCeleryManager
+	before the job is queued. `on_limit(RateLimited)` returns the callback's outputs for a rejected
+	request.
+	"""
+	def decorator(fn):
+		fn.rate_limit = {'on_limit': on_limit, 'scope': scope}
+		return fn
+	return decorator
@@ -1,6 +1,9 @@
 import os
 import math
+import time
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import pandas as pd
 import numpy as np
@@ -9,35 +12,185 @@ from google.cloud import secretmanager
 
 logger = logging.getLogger(__name__)
 
-def load_secret(secret_name: str, version: str = "latest") -> str:
+# ---------- Secrets ----------
+# Secrets are cached per process so request handlers never wait on Secret Manager after the first
+# fetch: fresh entries are served from memory, stale ones are served while a refresh runs in the
+# background, and a refresher thread renews entries before they go stale.
+SECRET_CACHE_TTL = int(os.getenv("SECRET_CACHE_TTL", "3600"))
+SECRET_REFRESH_INTERVAL = int(os.getenv("SECRET_REFRESH_INTERVAL", str(max(1, SECRET_CACHE_TTL // 2))))
+_secret_cache: dict[tuple[str, str], tuple[float, str]] = {}
+_secret_locks: dict[tuple[str, str], threading.Lock] = {}
+_secret_locks_guard = threading.Lock()
+_secret_refresher = {'pid': None}
+# Seconds before a failed project id lookup (google.auth.default()) is retried
+SECRET_PROJECT_RETRY = float(os.getenv("SECRET_PROJECT_RETRY", "60"))
+_gsm = {'client': None, 'project_id': None, 'project_retry_at': 0.0}
+
+def gsm_secret_provider(secret_name: str, version: str = "latest") -> str:
+	"""Reads a secret from Google Secret Manager, reusing one client per process. Raises on failure."""
+	if _gsm['project_id'] is None:
+		project_id = os.getenv("GOOGLE_CLOUD_PROJECT") or os.getenv("GCS_PROJECT_ID") or os.getenv("GCP_PROJECT") or os.getenv("PROJECT_ID")
+		# google.auth.default() can be slow (metadata server probes), so a failed lookup is not
+		# repeated on every call
+		if not project_id and time.monotonic() >= _gsm['project_retry_at']:
+			try:
+				_, project_id = google.auth.default()
+			except Exception as e:
+				logger.debug(f"Could not determine project ID via google.auth: {e}")
+			if not project_id:
+				_gsm['project_retry_at'] = time.monotonic() + SECRET_PROJECT_RETRY
+		if not project_id:
+			raise RuntimeError('GCP project id not set (GCP_PROJECT, GOOGLE_CLOUD_PROJECT, or PROJECT_ID). Are you signed in to gcloud cli?')
+		_gsm['project_id'] = project_id
+	if _gsm['client'] is None:
+		_gsm['client'] = secretmanager.SecretManagerServiceClient()
+	name = f"projects/{_gsm['project_id']}/secrets/{secret_name}/versions/{version}"
+	logger.debug(f"Accessing secret path: {name}")
+	response = _gsm['client'].access_secret_version(request={"name": name})
+	return response.payload.data.decode("utf-8")
+
+class LocalSecretProvider:
 	"""
-	Load a secret from Google Secret Manager.
-	Falls back to environment variable if GSM fails or project ID is missing.
+	Stand-in provider for tests and local development: serves secrets from a dict, or from the
+	environment when no dict is given. Enable with SECRET_PROVIDER=local or set_secret_provider().
 	"""
-	project_id = os.getenv("GOOGLE_CLOUD_PROJECT") or os.getenv("GCS_PROJECT_ID") or os.getenv("GCP_PROJECT")
-	
-	if not project_id:
-		try:
-			_, project_id = google.auth.default()
-		except Exception as e:
-			logger.debug(f"Could not determine project ID via google.auth: {e}")
-	
-	if project_id:
-		logger.info(f"Using Project ID: {project_id} for secret: {secret_name}")
+	def __init__(self, values: dict[str, str] | None = None):
+		self.values = values
+
+	def __call__(self, secret_name: str, version: str = "latest") -> str:
+		source = os.environ if self.values is None else self.values
+		if secret_name not in source:
+			raise KeyError(f"Secret {secret_name} not found in local provider")
+		return source[secret_name]
+
+_secret_provider = LocalSecretProvider() if os.getenv("SECRET_PROVIDER", "gsm").lower() in ('local', 'env') else gsm_secret_provider
+
+def set_secret_provider(provider) -> None:
+	"""Swaps the secret backend (a callable of (secret_name, version) -> str) and clears the cache."""
+	global _secret_provider
+	_secret_provider = provider
+	_secret_cache.clear()
+
+def _secret_lock(key: tuple[str, str]) -> threading.Lock:
+	with _secret_locks_guard:
+		return _secret_locks.setdefault(key, threading.Lock())
+
+def _refresh_secret(key: tuple[str, str]) -> str:
+	value = _secret_provider(*key)
+	_secret_cache[key] = (time.monotonic(), value)
+	return value
+
+def _refresh_in_background(key: tuple[str, str]) -> None:
+	lock = _secret_lock(key)
+	if not lock.acquire(blocking=False):
+		return  # a refresh is already running
+	def run():
 		try:
-			client = secretmanager.SecretManagerServiceClient()
-			name = f"projects/{project_id}/secrets/{secret_name}/versions/{version}"
-			logger.debug(f"Accessing secret path: {name}")
-			response = client.access_secret_version(request={"name": name})
-			return response.payload.data.decode("utf-8").strip()
+			_refresh_secret(key)
 		except Exception as e:
-			logger.warning(f"Could not load secret {secret_name} from GSM: {e}")
-			logger.error(f"GSM Access failed: {e}")
-	else:
-		logger.error(f"No Project ID found. Cannot access Secret Manager for {secret_name}")
-	
+			logger.warning(f"Background refresh of secret {key[0]} failed, keeping cached value: {e}")
+		finally:
+			lock.release()
+	threading.Thread(target=run, name=f'secret-refresh-{key[0]}', daemon=True).start()
+
+def _ensure_secret_refresher() -> None:
+	"""Starts the renewal thread once per process (again in each forked child)."""
+	pid = os.getpid()
+	if _secret_refresher['pid'] == pid:
+		return
+	with _secret_locks_guard:
+		if _secret_refresher['pid'] == pid:
+			return
+		_secret_refresher['pid'] = pid
+	def loop():
+		while True:
+			time.sleep(SECRET_REFRESH_INTERVAL)
+			now = time.monotonic()
+			for key, (fetched_at, _) in list(_secret_cache.items()):
+				if now - fetched_at >= SECRET_REFRESH_INTERVAL:
+					_refresh_in_background(key)
+	threading.Thread(target=loop, name='secret-refresher', daemon=True).start()
+
+def get_secret(secret_name: str, version: str = "latest") -> str:
+	"""
+	Returns a secret through the process cache. Concurrent first requests for the same secret share
+	one provider call. Raises if the secret has never been fetched successfully.
+	"""
+	_ensure_secret_refresher()
+	key = (secret_name, version)
+	cached = _secret_cache.get(key)
+	if cached is not None:
+		fetched_at, value = cached
+		if time.monotonic() - fetched_at >= SECRET_CACHE_TTL:
+			_refresh_in_background(key)
+		return value
+	with _secret_lock(key):
+		cached = _secret_cache.get(key)
+		if cached is not None:
+			return cached[1]
+		return _refresh_secret(key)
+
+def prefetch_secrets(secret_names: list[str]) -> None:
+	"""Warms the cache off the request path, e.g. at worker start, and keeps it renewed."""
+	_ensure_secret_refresher()
+	for secret_name in secret_names:
+		if (secret_name, "latest") not in _secret_cache:
+			_refresh_in_background((secret_name, "latest"))
+
+def load_secret(secret_name: str, version: str = "latest") -> str:
+	"""
+	Load a secret from Google Secret Manager (cached, see get_secret).
+	Falls back to environment variable if GSM fails or project ID is missing.
+	"""
+	try:
+		return get_secret(secret_name, version).strip()
+	except Exception as e:
+		logger.warning(f"Could not load secret {secret_name} from GSM: {e}")
 	return os.getenv(secret_name, "")
 
+class TTLCache:
+	"""
+	Small thread-safe in-process cache with per-entry expiry and LRU eviction.
+	Stored values may be falsy (e.g. cached negative decisions); use `MISS` to detect absence.
+	"""
+	MISS = object()
+
+	def __init__(self, ttl: float, max_entries: int = 1024):
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self._data: OrderedDict = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=MISS):
+		with self._lock:
+			item = self._data.get(key)
+			if item is None:
+				return default
+			expires_at, value = item
+			if expires_at <= time.monotonic():
+				del self._data[key]
+				return default
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key, value, ttl: float | None = None) -> None:
+		with self._lock:
+			self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+			self._data.move_to_end(key)
+			while len(self._data) > self.max_entries:
+				self._data.popitem(last=False)
+
+	def delete(self, key) -> None:
+		with self._lock:
+			self._data.pop(key, None)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
 def normalize_email_column(series: pd.Series) -> pd.Series:
 	"""
 	Normalize a pandas Series of emails:
@@ -0,0 +1,130 @@
+# redis_pool.py
+import os
+import logging
+import threading
+import redis
+from redis.utils import HIREDIS_AVAILABLE
+
+"""
+Shared Redis connection pools
+
+Every Redis consumer in the app (Flask/Dash, auth, caches, Celery) should get its client from
+get_redis_client() so connections come out of one bounded pool per process instead of one pool
+per `redis.from_url(...)` call.
+
+Settings (env):
+	REDIS_MAX_CONNECTIONS            pool size per process (default 20)
+	REDIS_POOL_TIMEOUT               seconds to wait for a free connection before erroring (default 5)
+	REDIS_SOCKET_TIMEOUT             read/write timeout in seconds (default 5)
+	REDIS_SOCKET_CONNECT_TIMEOUT     connect timeout in seconds (default 5)
+	REDIS_HEALTH_CHECK_INTERVAL      seconds between PINGs on idle connections (default 30)
+
+redis-py uses the hiredis parser automatically when the `hiredis` package is installed (uv add hiredis).
+Note that each pub/sub subscriber thread holds one connection for its lifetime.
+"""
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '20'))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', '5'))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '5'))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', '5'))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', '30'))
+
+_pools: dict[str, redis.BlockingConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def _reset_after_fork() -> None:
+	# Connections inherited from the parent must never be used by the child
+	global _pools_lock
+	_pools_lock = threading.Lock()
+	for pool in _pools.values():
+		pool.reset()
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_pool(url: str | None = None) -> redis.BlockingConnectionPool:
+	url = url or REDIS_URL
+	pool = _pools.get(url)
+	if pool is not None:
+		return pool
+	with _pools_lock:
+		pool = _pools.get(url)
+		if pool is None:
+			pool = redis.BlockingConnectionPool.from_url(
+				url,
+				max_connections=REDIS_MAX_CONNECTIONS,
+				timeout=REDIS_POOL_TIMEOUT,
+				socket_timeout=REDIS_SOCKET_TIMEOUT,
+				socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+				health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+				socket_keepalive=True,
+			)
+			_pools[url] = pool
+			logger.info(f'Created Redis pool (max {REDIS_MAX_CONNECTIONS} connections, hiredis: {HIREDIS_AVAILABLE})')
+		return pool
+
+def get_redis_client(url: str | None = None) -> redis.Redis:
+	"""Returns a client backed by the shared pool for `url` (defaults to REDIS_URL)."""
+	return redis.Redis(connection_pool=get_pool(url))
+
+def _pool_counts(pool: redis.BlockingConnectionPool) -> tuple[int | None, int | None]:
+	"""
+	(created, idle) connections. redis-py has no public API for these, so read its internals
+	defensively: anything missing or renamed in another release is reported as None.
+	"""
+	connections = getattr(pool, '_connections', None)
+	created = len(connections) if isinstance(connections, (list, set)) else None
+	queue = getattr(getattr(pool, 'pool', None), 'queue', None)
+	try:
+		# BlockingConnectionPool pre-fills its queue with None placeholders for unopened slots
+		idle = sum(1 for c in list(queue) if c is not None) if queue is not None else None
+	except TypeError:
+		idle = None
+	return created, idle
+
+def pool_stats() -> dict:
+	"""
+	Saturation snapshot per pool for this process: connections created, checked out and idle,
+	and utilization against max_connections. Sustained utilization near 1.0 means requests are
+	queueing on the pool; size workers x REDIS_MAX_CONNECTIONS against Redis maxclients.
+	"""
+	stats = {}
+	for url, pool in list(_pools.items()):
+		created, idle = _pool_counts(pool)
+		in_use = created - idle if created is not None and idle is not None else None
+		parsed = redis.connection.parse_url(url)
+		stats[f"{parsed.get('host', '')}:{parsed.get('port', '')}/{parsed.get('db', 0)}"] = {
+			'pid': os.getpid(),
+			'max_connections': pool.max_connections,
+			'created': created,
+			'in_use': in_use,
+			'idle': idle,
+			'utilization': round(in_use / pool.max_connections, 3) if in_use is not None else None,
+		}
+	return stats
+
+def celery_redis_settings() -> dict:
+	"""
+	Celery/kombu build their own Redis pools for the broker and result backend, so apply the same
+	limits and timeouts there.
+	"""
+	transport_options = {
+		'max_connections': REDIS_MAX_CONNECTIONS,
+		'socket_timeout': REDIS_SOCKET_TIMEOUT,
+		'socket_connect_timeout': REDIS_SOCKET_CONNECT_TIMEOUT,
+		'health_check_interval': REDIS_HEALTH_CHECK_INTERVAL,
+		'socket_keepalive': True,
+	}
+	return {
+		'broker_pool_limit': REDIS_MAX_CONNECTIONS,
+		'broker_transport_options': transport_options,
+		'result_backend_transport_options': transport_options,
+		'redis_max_connections': REDIS_MAX_CONNECTIONS,
+		'redis_socket_timeout': REDIS_SOCKET_TIMEOUT,
+		'redis_socket_connect_timeout': REDIS_SOCKET_CONNECT_TIMEOUT,
+		'redis_backend_health_check_interval': REDIS_HEALTH_CHECK_INTERVAL,
+		'redis_socket_keepalive': True,
+	}
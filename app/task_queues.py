@@ -0,0 +1,234 @@
+import os
+import json
+import uuid
+import logging
+from kombu import Queue
+from kombu.utils.json import dumps as kombu_dumps, loads as kombu_loads
+from celery.signals import task_postrun, task_revoked
+from dash import CeleryManager
+from plotly.utils import PlotlyJSONEncoder
+from dash_app.background_jobs import (
+	BACKGROUND_JOB_TTL, BACKGROUND_RESULT_TTL, cancellable, coalesce_job, current_session_id, finish_job, flag_cancelled,
+	job_registered, register_job, subscribe, track_job, unsubscribe,
+)
+from dash_app.rate_limit import FairQueue, RateLimited, admit, release
+
+"""
+Celery task classes
+
+Background work is split into classes, each with its own queue and worker pool, so a short palette
+request never waits behind a multi-minute deck generation:
+	text          short text LLM calls (color palettes); highest priority
+	image         image generation and slide decks; long-running, few slots
+	data          data loading / ETL
+	maintenance   housekeeping, including Celery's own celery.* tasks; lowest priority
+Queues are named '{SERVER_NAME}.{class}' so apps sharing a Redis server stay apart.
+
+Dash background callbacks are routed by the manager they're registered with (see
+QueuedCeleryManager), which also coalesces identical requests onto one job, cancels a session's
+superseded jobs (see dash_app.background_jobs), and applies admission control and fair-share
+dispatch before anything is queued (see dash_app.rate_limit). Plain Celery tasks pick a class with
+@celery_app.task(queue=queue_name(...)) or fall back to 'text'. Message priorities are enabled on the
+Redis broker and workers listening to several queues drain them in the order given to -Q, so a
+single dev worker still serves text first.
+
+Per-queue concurrency and prefetch are worker flags (--concurrency, --prefetch-multiplier); see the
+worker services in infrastructure/scripts/docker-compose.yml.tftpl.
+
+Settings (env):
+	{CLASS}_WORKER_CONCURRENCY   worker processes serving a class, e.g. IMAGE_WORKER_CONCURRENCY
+	                             (defaults: text 4, image 2, data 1, maintenance 1); also how many
+	                             callback jobs are sent to that queue at once
+	CELERY_PREFETCH_MULTIPLIER   default messages reserved per worker process (default 1)
+	CELERY_TASK_ACKS_LATE        ack after the task runs, so a worker only reserves what it's
+	                             ready to run (default true)
+"""
+
+logger = logging.getLogger(__name__)
+
+CELERY_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_PREFETCH_MULTIPLIER', '1'))
+CELERY_TASK_ACKS_LATE = os.getenv('CELERY_TASK_ACKS_LATE', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+
+# Task class -> message priority (Redis broker: 0 is served first)
+TASK_CLASSES = {
+	'text': 0,
+	'image': 5,
+	'data': 5,
+	'maintenance': 9,
+}
+DEFAULT_TASK_CLASS = 'text'
+WORKER_CONCURRENCY = {
+	task_class: int(os.getenv(f'{task_class.upper()}_WORKER_CONCURRENCY', default))
+	for task_class, default in {'text': '4', 'image': '2', 'data': '1', 'maintenance': '1'}.items()
+}
+# Dash names background callback tasks background_callback_<hash>
+CALLBACK_TASK_PREFIX = 'background_callback_'
+# Job ids handed back for requests rejected at admission; their response is stored under the id
+REJECTED_JOB_PREFIX = 'rejected-'
+
+_fair_queues: dict[str, FairQueue] = {}
+
+def queue_name(server_name: str, task_class: str) -> str:
+	if task_class not in TASK_CLASSES:
+		raise ValueError(f'Unknown task class: {task_class}')
+	return f'{server_name}.{task_class}'
+
+def celery_queue_settings(server_name: str, broker_transport_options: dict | None = None) -> dict:
+	"""Celery config for the task class queues. Pass the existing broker transport options to extend them."""
+	return {
+		'task_queues': [Queue(queue_name(server_name, task_class)) for task_class in TASK_CLASSES],
+		'task_default_queue': queue_name(server_name, DEFAULT_TASK_CLASS),
+		'task_default_priority': TASK_CLASSES[DEFAULT_TASK_CLASS],
+		'task_routes': {
+			'celery.*': {'queue': queue_name(server_name, 'maintenance'), 'priority': TASK_CLASSES['maintenance']},
+			'app.*': {'queue': queue_name(server_name, DEFAULT_TASK_CLASS)},
+		},
+		'broker_transport_options': {
+			**(broker_transport_options or {}),
+			'priority_steps': list(range(10)),
+			'sep': ':',
+			'queue_order_strategy': 'priority',
+		},
+		'worker_prefetch_multiplier': CELERY_PREFETCH_MULTIPLIER,
+		'task_acks_late': CELERY_TASK_ACKS_LATE,
+	}
+
+def _fair_queue(queue: str, task_class: str) -> FairQueue:
+	if queue not in _fair_queues:
+		# Waiting jobs live as long as their metadata, which Dash polls on, so none is dropped while a page waits for it
+		_fair_queues[queue] = FairQueue(queue, WORKER_CONCURRENCY[task_class], held_ttl=BACKGROUND_JOB_TTL)
+	return _fair_queues[queue]
+
+def _send(celery_app, payload: str) -> None:
+	job = kombu_loads(payload)
+	celery_app.send_task(job['name'], args=job['args'], task_id=job['id'], queue=job['queue'], priority=job['priority'])
+
+def release_job(celery_app, job_id: str) -> None:
+	"""Gives back what a finished, revoked or rejected job held, and sends the next jobs waiting for its worker."""
+	meta = finish_job(job_id)
+	release(meta.get('slot'))
+	if meta.get('cache_key'):
+		# Readable by every session polling for it for a while, then gone even if nobody did
+		celery_app.backend.expire(meta['cache_key'], BACKGROUND_RESULT_TTL)
+	if meta.get('queue'):
+		for payload in _fair_queue(meta['queue'], meta['task_class']).finish(job_id):
+			_send(celery_app, payload)
+
+def cancel_job(celery_app, job_id: str) -> None:
+	"""Stops a job nobody is waiting for: flags it, revokes it (killing it if running) and releases what it held."""
+	flag_cancelled(job_id)
+	celery_app.control.revoke(job_id, terminate=True)
+	release_job(celery_app, job_id)
+
+class QueuedCeleryManager(CeleryManager):
+	"""
+	CeleryManager that sends the background callbacks registered with it to one task class's queue.
+	Jobs are subscribed to by the sessions waiting on them and cancelled once none are left.
+	"""
+
+	def __init__(self, celery_app, server_name: str, task_class: str, **kwargs):
+		# Filled by make_job_fn, which the base class calls for already-registered callbacks
+		self.rate_limits = {}
+		super().__init__(celery_app, **kwargs)
+		self.task_class = task_class
+		self.queue = queue_name(server_name, task_class)
+		self.priority = TASK_CLASSES[task_class]
+
+	def call_job_fn(self, key, job_fn, args, context):
+		job_id = str(uuid.uuid4())
+		session_id = current_session_id() or 'anonymous'
+		# `key` is Dash's cache key, i.e. the callback's arguments minus cache_args_to_ignore
+		if self.result_ready(key):
+			# The last job for this key just finished and sessions may still be reading its result
+			# (it expires BACKGROUND_RESULT_TTL after the job ends), so serve it instead of replacing it
+			logger.info(f'[{job_fn.name}] reusing the result of a just-finished job')
+			self.handle.backend.expire(key, BACKGROUND_RESULT_TTL)
+			self._follow(job_fn.name, session_id, job_id)
+			return job_id
+		leader = coalesce_job(key, job_id)
+		if leader != job_id:
+			logger.info(f'[{job_fn.name}] coalesced onto in-flight job {leader}')
+			self._follow(job_fn.name, session_id, leader)
+			return leader
+		register_job(job_id, cache_key=key, queue=self.queue, task_class=self.task_class)
+		# Before admission, so the slot of the job this one supersedes is already free
+		self._follow(job_fn.name, session_id, job_id)
+		payload = kombu_dumps({
+			'name': job_fn.name,
+			'id': job_id,
+			'args': [key, self._make_progress_key(key), args, context],
+			'queue': self.queue,
+			'priority': self.priority,
+		})
+		limit = self.rate_limits.get(job_fn.name)
+		try:
+			if limit:
+				register_job(job_id, slot=admit(session_id, limit['scope']))
+			ready = _fair_queue(self.queue, self.task_class).submit(job_id, session_id, payload)
+		except RateLimited as e:
+			logger.info(f'[{job_fn.name}] rate limited session: {e}')
+			unsubscribe(job_id, session_id)
+			release_job(self.handle, job_id)
+			return self._reject(limit['on_limit'](e) if limit else None)
+		for ready_payload in ready:
+			_send(self.handle, ready_payload)
+		return job_id
+
+	def _follow(self, callback: str, session_id: str, job_id: str) -> None:
+		subscribe(job_id, session_id)
+		previous = track_job(callback, session_id, job_id)
+		if previous and unsubscribe(previous, session_id):
+			logger.info(f'[{callback}] cancelling superseded job {previous}')
+			cancel_job(self.handle, previous)
+
+	def _reject(self, output) -> str:
+		job = f'{REJECTED_JOB_PREFIX}{uuid.uuid4()}'
+		self.handle.backend.set(job, json.dumps(output, cls=PlotlyJSONEncoder))
+		return job
+
+	def get_result(self, key, job):
+		if job and job.startswith(REJECTED_JOB_PREFIX):
+			result = self.handle.backend.get(job)
+			self.handle.backend.delete(job)
+			return self.UNDEFINED if result is None else json.loads(result)
+		result = self.handle.backend.get(key)
+		if result is None:
+			return self.UNDEFINED
+		# Coalesced requests read the same key, so let it expire instead of deleting it on first read
+		self.handle.backend.expire(key, BACKGROUND_RESULT_TTL)
+		self.clear_cache_entry(self._make_progress_key(key))
+		# Delivered, so this session no longer holds the job open; it has finished, nothing to cancel
+		unsubscribe(job, current_session_id() or 'anonymous')
+		return json.loads(result)
+
+	def job_running(self, job):
+		# Results are ignored, so Celery reports PENDING forever; the job's metadata lives until it ends
+		return bool(job) and job_registered(job)
+
+	def make_job_fn(self, fn, progress, key=None):
+		job_fn = super().make_job_fn(cancellable(fn, progress), progress, key)
+		if getattr(fn, 'rate_limit', None):
+			self.rate_limits[job_fn.name] = fn.rate_limit
+		return job_fn
+
+	def terminate_job(self, job):
+		# Dash's cancel inputs and same-tab re-triggers land here; other sessions may share the job
+		if not job or job.startswith(REJECTED_JOB_PREFIX):
+			return
+		if unsubscribe(job, current_session_id() or 'anonymous'):
+			logger.info(f'Cancelling background job {job}')
+			cancel_job(self.handle, job)
+
+def create_callback_managers(celery_app, server_name: str) -> dict[str, QueuedCeleryManager]:
+	return {task_class: QueuedCeleryManager(celery_app, server_name, task_class) for task_class in TASK_CLASSES}
+
+@task_postrun.connect
+def _finish_callback_job(sender=None, task_id=None, **kwargs):
+	if sender is not None and sender.name.startswith(CALLBACK_TASK_PREFIX):
+		release_job(sender.app, task_id)
+
+@task_revoked.connect
+def _finish_revoked_callback_job(sender=None, request=None, **kwargs):
+	# Revoked jobs never reach task_postrun: discarded before starting, or terminated mid-run
+	if sender is not None and request is not None and sender.name.startswith(CALLBACK_TASK_PREFIX):
+		release_job(sender.app, request.id)
@@ -0,0 +1,158 @@
+"""
+CloudStorage I/O benchmarks
+
+Runs the parquet read/write paths of dash_app.cloud_storage.CloudStorage against the offline
+'memory' and 'file' backends, across data sizes and partition counts, so I/O regressions show up
+locally instead of in production.
+
+Usage (from the repository root):
+	python benchmarks/cloud_storage_bench.py                                   # default grid, both backends
+	python benchmarks/cloud_storage_bench.py --protocol memory --rows 100000 --partitions 1 30
+	python benchmarks/cloud_storage_bench.py --save baseline.json              # record a baseline
+	python benchmarks/cloud_storage_bench.py --compare baseline.json           # exit 1 on >25% slowdown
+"""
+import sys
+import json
+import time
+import shutil
+import argparse
+import logging
+import statistics
+import tempfile
+import pathlib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'app'))
+from dash_app.cloud_storage import CloudStorage
+
+logging.basicConfig(level=logging.WARNING)
+
+CASES = [
+	'store_dataset_parquet',
+	'append_dataset_parquet',
+	'append_dataset_parquet[replace_partitions]',
+	'load_dataset_parquet',
+	'load_dataset_parquet[arrow]',
+	'append_to_dataset_parquet',
+]
+
+def make_frame(rows: int, partitions: int, seed: int = 0) -> pd.DataFrame:
+	"""Synthetic frame shaped like traffic_daily.csv, with `partitions` distinct dates."""
+	rng = np.random.default_rng(seed)
+	dates = pd.date_range('2024-01-01', periods=partitions, freq='D').strftime('%Y-%m-%d')
+	return pd.DataFrame({
+		'date': rng.choice(dates, rows),
+		'country': rng.choice(['US', 'CA', 'GB', 'DE', 'BR', 'IN'], rows),
+		'device_type': rng.choice(['mobile', 'desktop', 'ctv', 'tablet'], rows),
+		'video_title': rng.choice([f'Show {i}' for i in range(200)], rows).astype(object),
+		'users': rng.integers(0, 10_000, rows),
+		'video_plays': rng.integers(0, 50_000, rows),
+		'watch_time': rng.random(rows) * 1000,
+	})
+
+def run_case(storage: CloudStorage, case: str, df: pd.DataFrame, path: str) -> float:
+	"""Times one case. Setup writes happen outside the timed section."""
+	def seed():
+		storage.store_dataset_parquet(df, path, partition_cols=['date'], mode='delete_matching')
+
+	if case == 'store_dataset_parquet':
+		start = time.perf_counter()
+		seed()
+	elif case == 'append_dataset_parquet':
+		seed()
+		start = time.perf_counter()
+		storage.append_dataset_parquet(df, path, partition_cols=['date'])
+	elif case == 'append_dataset_parquet[replace_partitions]':
+		seed()
+		start = time.perf_counter()
+		storage.append_dataset_parquet(df, path, partition_cols=['date'], replace_partitions=True)
+	elif case == 'load_dataset_parquet':
+		seed()
+		start = time.perf_counter()
+		storage.load_dataset_parquet(path)
+	elif case == 'load_dataset_parquet[arrow]':
+		seed()
+		start = time.perf_counter()
+		storage.load_dataset_parquet(path, output='arrow')
+	elif case == 'append_to_dataset_parquet':
+		storage.store_data_parquet(df, path=path)
+		start = time.perf_counter()
+		storage.append_to_dataset_parquet(df, path=path, file_name='data.parquet')
+	else:
+		raise ValueError(f'Unknown case: {case}')
+	return time.perf_counter() - start
+
+def clear(storage: CloudStorage, path: str) -> None:
+	target = f'{storage.bucket}/{path}'
+	if storage.fs.exists(target):
+		storage.fs.rm(target, recursive=True)
+
+def run(protocols: list[str], rows: list[int], partitions: list[int], cases: list[str], repeat: int) -> list[dict]:
+	results = []
+	root = tempfile.mkdtemp(prefix='cloud-storage-bench-')
+	try:
+		for protocol in protocols:
+			storage = CloudStorage(protocol=protocol, endpoint=root if protocol == 'file' else None)
+			for n_rows in rows:
+				for n_parts in partitions:
+					df = make_frame(n_rows, n_parts)
+					for case in cases:
+						path = f'bench/{case.replace("[", "_").replace("]", "")}/{n_rows}_{n_parts}'
+						timings = []
+						for _ in range(repeat):
+							clear(storage, path)
+							timings.append(run_case(storage, case, df, path))
+						clear(storage, path)
+						result = {
+							'protocol': protocol,
+							'case': case,
+							'rows': n_rows,
+							'partitions': n_parts,
+							'median_s': statistics.median(timings),
+							'min_s': min(timings),
+						}
+						results.append(result)
+						print(f"{protocol:<7} {case:<44} rows={n_rows:<9,} parts={n_parts:<5} median={result['median_s']*1000:9.1f}ms  min={result['min_s']*1000:9.1f}ms", flush=True)
+	finally:
+		shutil.rmtree(root, ignore_errors=True)
+	return results
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[str]:
+	with open(baseline_path) as f:
+		baseline = {(b['protocol'], b['case'], b['rows'], b['partitions']): b for b in json.load(f)}
+	regressions = []
+	for r in results:
+		b = baseline.get((r['protocol'], r['case'], r['rows'], r['partitions']))
+		if b and r['median_s'] > b['median_s'] * (1 + threshold):
+			regressions.append(
+				f"{r['protocol']} {r['case']} rows={r['rows']} parts={r['partitions']}: "
+				f"{b['median_s']*1000:.1f}ms -> {r['median_s']*1000:.1f}ms"
+			)
+	return regressions
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description='Benchmark CloudStorage parquet I/O on offline backends')
+	parser.add_argument('--protocol', nargs='+', default=['memory', 'file'], choices=['memory', 'file'])
+	parser.add_argument('--rows', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+	parser.add_argument('--partitions', nargs='+', type=int, default=[1, 10, 100])
+	parser.add_argument('--case', nargs='+', default=CASES, choices=CASES)
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--save', help='write results to this JSON file')
+	parser.add_argument('--compare', help='baseline JSON file from a previous --save run')
+	parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown vs baseline (0.25 = 25%%)')
+	args = parser.parse_args()
+
+	results = run(args.protocol, args.rows, args.partitions, args.case, args.repeat)
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent=2)
+	if args.compare:
+		regressions = compare(results, args.compare, args.threshold)
+		for r in regressions:
+			print(f'REGRESSION {r}')
+		return 1 if regressions else 0
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
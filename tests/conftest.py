@@ -0,0 +1,7 @@
+import os
+
+# Modules read these at import; tests never reach these services
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/15')
+os.environ.setdefault('SERVER_NAME', 'test')
+os.environ.setdefault('DEPLOY_ENV', 'dev')
+os.environ.setdefault('SECRET_PROVIDER', 'local')
@@ -0,0 +1,46 @@
+import sys
+import types
+
+import dash
+import pytest
+from celery import Celery
+
+
+@pytest.fixture(scope='module')
+def dash_app():
+	from task_queues import create_callback_managers
+
+	# register_callbacks takes its managers from the app module; build them on an in-memory broker
+	celery_app = Celery('test', broker='memory://', backend='cache+memory://')
+	fake_app = types.SimpleNamespace(BACKGROUND_CALLBACK_MANAGERS=create_callback_managers(celery_app, 'test'))
+	previous = sys.modules.get('app')
+	sys.modules['app'] = fake_app
+	try:
+		from dash_app.callbacks import register_callbacks
+		app = dash.Dash(__name__, suppress_callback_exceptions=True)
+		register_callbacks(app)
+	finally:
+		if previous is None:
+			sys.modules.pop('app', None)
+		else:
+			sys.modules['app'] = previous
+	return app
+
+
+def _outputs(callback_id):
+	return set(callback_id.strip('.').split('...'))
+
+
+def test_sales_deck_callback_is_registered(dash_app):
+	assert any('sales-download-deck.data' in callback_id for callback_id in dash_app.callback_map)
+
+
+def test_progress_outputs_do_not_overlap_callback_outputs(dash_app):
+	checked = 0
+	for callback_id, spec in dash_app.callback_map.items():
+		progress = (spec.get('background') or {}).get('progress')
+		if not progress:
+			continue
+		checked += 1
+		assert not {str(o) for o in progress} & _outputs(callback_id), callback_id
+	assert checked
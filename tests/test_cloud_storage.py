@@ -0,0 +1,39 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from dash_app.cloud_storage import CloudStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return CloudStorage(protocol='file', endpoint=str(tmp_path), bucket='bucket')
+
+
+def _dataset_files(storage, path):
+    base_dir = storage._dataset_base_dir(path)
+    return [f'{base_dir}/{f["path"]}' for f in storage._read_manifest(base_dir)['files']]
+
+
+def test_target_file_bytes_with_default_row_groups(storage):
+    df = pd.DataFrame({'id': range(10_000), 'value': [float(i) for i in range(10_000)]})
+
+    storage.store_dataset_parquet(df, 'events', row_group_rows=None, target_file_bytes=16_000)
+
+    files = _dataset_files(storage, 'events')
+    assert len(files) > 1
+    for file_path in files:
+        metadata = pq.read_metadata(file_path)
+        assert all(metadata.row_group(i).num_rows <= metadata.num_rows for i in range(metadata.num_row_groups))
+    assert len(storage.load_dataset_parquet('events')) == len(df)
+
+
+def test_append_forwards_write_options(storage):
+    df = pd.DataFrame({'city': ['Paris', 'Lyon'] * 50, 'day': ['2024-01-01'] * 100})
+
+    storage.store_dataset_parquet(df, 'visits', partition_cols=['day'])
+    storage.append_dataset_parquet(df, 'visits', partition_cols=['day'], use_dictionary=False, write_page_index=False)
+
+    appended = pq.read_metadata(_dataset_files(storage, 'visits')[-1]).row_group(0).column(0)
+    assert not appended.has_dictionary_page
+    assert not appended.has_offset_index
@@ -0,0 +1,84 @@
+import json
+import time
+import types
+
+import fakeredis
+import pytest
+from celery import Celery
+
+import task_queues
+from dash_app import background_jobs, rate_limit
+
+@pytest.fixture
+def redis_client(monkeypatch):
+	client = fakeredis.FakeRedis()
+	monkeypatch.setattr(background_jobs, 'get_redis_client', lambda *args, **kwargs: client)
+	monkeypatch.setattr(rate_limit, 'get_redis_client', lambda *args, **kwargs: client)
+	monkeypatch.setattr(task_queues, '_fair_queues', {})
+	return client
+
+@pytest.fixture
+def celery_app(redis_client):
+	app = Celery('test', broker='memory://', backend='redis://localhost:6379/15')
+	app.backend.client = redis_client
+	app.sent = []
+	app.send_task = lambda name, task_id=None, **kwargs: app.sent.append(task_id)
+	app.control.revoke = lambda *args, **kwargs: None
+	return app
+
+def _as(monkeypatch, session_id):
+	monkeypatch.setattr(task_queues, 'current_session_id', lambda: session_id)
+
+def test_new_request_after_finish_keeps_result_for_followers(monkeypatch, celery_app, redis_client):
+	manager = task_queues.QueuedCeleryManager(celery_app, 'test', 'image')
+	job_fn = types.SimpleNamespace(name=f'{task_queues.CALLBACK_TASK_PREFIX}test')
+	key = 'deck-key'
+
+	_as(monkeypatch, 'a')
+	job = manager.call_job_fn(key, job_fn, [], {})
+	_as(monkeypatch, 'b')
+	assert manager.call_job_fn(key, job_fn, [], {}) == job
+	assert celery_app.sent == [job]
+
+	# The worker writes the result, then task_postrun releases the job
+	celery_app.backend.set(key, json.dumps('deck'))
+	task_queues.release_job(celery_app, job)
+	assert 0 < redis_client.ttl(key) <= task_queues.BACKGROUND_RESULT_TTL
+	_as(monkeypatch, 'a')
+	assert manager.get_result(key, job) == 'deck'
+
+	# The same request from another session before follower b has polled
+	_as(monkeypatch, 'c')
+	reused = manager.call_job_fn(key, job_fn, [], {})
+	assert celery_app.sent == [job]
+	assert manager.get_result(key, reused) == 'deck'
+	_as(monkeypatch, 'b')
+	assert manager.get_result(key, job) == 'deck'
+
+	# Once the result has expired, the request runs again
+	redis_client.delete(key)
+	_as(monkeypatch, 'd')
+	rerun = manager.call_job_fn(key, job_fn, [], {})
+	assert rerun not in (job, reused)
+	assert celery_app.sent == [job, rerun]
+
+def test_waiting_job_outlives_slot_ttl(monkeypatch, celery_app, redis_client):
+	monkeypatch.setitem(task_queues.WORKER_CONCURRENCY, 'image', 1)
+	manager = task_queues.QueuedCeleryManager(celery_app, 'test', 'image')
+	job_fn = types.SimpleNamespace(name=f'{task_queues.CALLBACK_TASK_PREFIX}test')
+
+	_as(monkeypatch, 'a')
+	running = manager.call_job_fn('key-a', job_fn, [], {})
+	_as(monkeypatch, 'b')
+	waiting = manager.call_job_fn('key-b', job_fn, [], {})
+	assert celery_app.sent == [running]
+
+	# Still queued after a worker slot would have been reclaimed, and sent once the worker frees up
+	held = f'fair-queue:{manager.queue}:held'
+	now = time.time()
+	assert redis_client.zscore(held, waiting) > now + rate_limit.AI_JOB_SLOT_TTL
+	assert redis_client.ttl(f'fair-queue:{manager.queue}:job:{waiting}') > rate_limit.AI_JOB_SLOT_TTL
+	monkeypatch.setattr(rate_limit, 'time', types.SimpleNamespace(time=lambda: now + rate_limit.AI_JOB_SLOT_TTL + 60))
+	task_queues.release_job(celery_app, running)
+	assert celery_app.sent == [running, waiting]
+	assert manager.job_running(waiting)